@@ -0,0 +1,836 @@
+"""
+Benchmarks for the decision tree implementations, run against the data sets
+in example_data.
+
+"""
+
+import argparse
+import csv
+from collections import Counter
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import criteria
+import dataset
+import distributed
+import id3
+import registry
+
+DATASETS = [
+    'example_data/baseball.csv',
+    'example_data/fish.csv',
+    'example_data/breast-cancer-training.csv',
+    'example_data/breast-cancer-wisconsin.csv',
+    'example_data/nursery.csv',
+]
+
+
+def timed(func, *args, **kwargs):
+    """
+    Call func with the given arguments.
+
+    Returns:
+        A tuple of the result of the call and the wall time it took in
+        seconds.
+
+    """
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+
+def scaled_copy(filename, scale):
+    """
+    Write a temporary copy of the given CSV file with its rows repeated scale
+    times.
+
+    Returns:
+        The path of the copy, which the caller should remove.
+
+    """
+    with open(filename) as f:
+        header, rows = f.readline(), f.readlines()
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'w') as f:
+        f.write(header)
+        for _ in xrange(scale):
+            f.writelines(rows)
+    return path
+
+
+def sharded_copies(filename, scale, num_shards):
+    """
+    Write the rows of the given CSV file, repeated scale times, to
+    num_shards temporary CSV files with the same header, dealing them out in
+    turn.
+
+    Returns:
+        The paths of the shards, which the caller should remove.
+
+    """
+    with open(filename) as f:
+        header, rows = f.readline(), f.readlines()
+    paths = []
+    for i in xrange(num_shards):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write(header)
+            for _ in xrange(scale):
+                f.writelines(rows[i::num_shards])
+        paths.append(path)
+    return paths
+
+
+def with_missing(filename, rate, seed=0):
+    """
+    Write a temporary copy of the given CSV file in which each independent
+    value is replaced by '?' with the given probability.
+
+    Returns:
+        The path of the copy, which the caller should remove.
+
+    """
+    rng = random.Random(seed)
+    with open(filename) as f:
+        reader = csv.reader(f)
+        header, rows = reader.next(), list(reader)
+    for row in rows:
+        for i in xrange(len(row) - 1):
+            if rng.random() < rate:
+                row[i] = '?'
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return path
+
+
+def legacy_parse(csv_file):
+    """
+    Parse the given CSV file into row dictionaries and distinct values the
+    way DTree did before the encoded data set was introduced.
+
+    """
+    reader = csv.reader(csv_file)
+    attributes = reader.next()
+    data = [dict(zip(attributes, row)) for row in reader]
+    csv_file.close()
+    values = dict((a, set(r[a] for r in data)) for a in attributes)
+    return data, values
+
+
+def model_size(tree):
+    """
+    Return the number of bytes taken up by the saved model of the given tree.
+
+    """
+    fd, path = tempfile.mkstemp(suffix='.model')
+    os.close(fd)
+    try:
+        tree.save(open(path, 'wb'))
+        return os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+
+def decision_rate(tree, rows, repeat):
+    """
+    Return the number of decisions per second made by the given tree over
+    repeat passes of rows.
+
+    """
+    _, elapsed = timed(lambda: [tree.decide(r) for _ in xrange(repeat)
+                                for r in rows])
+    return len(rows) * repeat / elapsed
+
+
+def memory_cgroup(megabytes):
+    """
+    Create a memory cgroup limited to the given number of megabytes, through
+    the cgroup v2 memory controller (memory.max) or else the v1 one
+    (memory.limit_in_bytes), with swap disabled where the controller allows
+    it. Requires write access to the cgroup file system, e.g. as root.
+
+    Returns:
+        The path of the cgroup, which the caller should remove with
+        os.rmdir() once its processes have exited, or None if no memory
+        cgroup could be created.
+
+    """
+    limit = str(int(megabytes * 2 ** 20))
+    with open('/proc/self/mounts') as mounts:
+        entries = [line.split()[1:4] for line in mounts]
+    for mount, kind, options in entries:
+        if kind == 'cgroup2':
+            try:
+                with open(os.path.join(mount, 'cgroup.controllers')) as f:
+                    if 'memory' not in f.read().split():
+                        continue
+            except IOError:
+                continue
+            files = [('memory.max', limit), ('memory.swap.max', '0')]
+        elif kind == 'cgroup' and 'memory' in options.split(','):
+            files = [('memory.limit_in_bytes', limit),
+                     ('memory.memsw.limit_in_bytes', limit)]
+        else:
+            continue
+        path = os.path.join(mount, 'dtree-benchmark-{0}'.format(os.getpid()))
+        try:
+            os.mkdir(path)
+        except OSError:
+            continue
+        for i, (name, value) in enumerate(files):
+            try:
+                with open(os.path.join(path, name), 'w') as f:
+                    f.write(value)
+            except IOError:
+                if not i:  # The limit itself is required
+                    os.rmdir(path)
+                    break
+        else:
+            return path
+    return None
+
+
+def peak_memory(func, *args, **kwargs):
+    """
+    Call func with the given arguments in a forked process, so that its
+    memory use is measured apart from the benchmark's own. The resident
+    memory of the process is sampled while it runs.
+
+    Args:
+        cgroup: a keyword argument naming a cgroup (see memory_cgroup()) to
+            run the process in (default None).
+    Returns:
+        A tuple of the wall time the call took in seconds, and the peak
+        anonymous and file-backed resident memory of the process in
+        megabytes.
+    Raises:
+        RuntimeError: if the call failed, e.g. by running out of memory.
+
+    """
+    cgroup = kwargs.pop('cgroup', None)
+    start = time.time()
+    pid = os.fork()
+    if not pid:
+        try:
+            if cgroup is not None:
+                with open(os.path.join(cgroup, 'cgroup.procs'), 'w') as f:
+                    f.write(str(os.getpid()))
+            func(*args, **kwargs)
+        except BaseException:
+            os._exit(1)
+        os._exit(0)
+
+    peaks = {'RssAnon:': 0, 'RssFile:': 0}
+    while True:
+        try:
+            with open('/proc/{0}/status'.format(pid)) as f:
+                for line in f:
+                    fields = line.split()
+                    if fields and fields[0] in peaks:
+                        peaks[fields[0]] = max(peaks[fields[0]],
+                                               int(fields[1]))
+        except IOError:
+            pass
+        finished, status = os.waitpid(pid, os.WNOHANG)
+        if finished:
+            break
+        time.sleep(0.01)
+    if status:
+        raise RuntimeError("benchmarked process failed")
+    return (time.time() - start, peaks['RssAnon:'] / 1024.,
+            peaks['RssFile:'] / 1024.)
+
+
+def train(filename, **kwargs):
+    """
+    Build an ID3 tree on the given CSV file, passing kwargs on to ID3.
+
+    """
+    id3.ID3(open(filename), **kwargs).create_tree()
+
+
+def train_copied(filename, directory):
+    """
+    Build an ID3 tree on the given CSV file through mmap from a copy of the
+    converted directory made by the calling process. Page cache is charged
+    to the memory cgroup that first reads or writes it, so copying the code
+    files first puts them under the caller's cgroup limit.
+
+    """
+    copy = tempfile.mkdtemp()
+    try:
+        for name in os.listdir(directory):
+            shutil.copy(os.path.join(directory, name), copy)
+        train(filename, mmap_dir=copy)
+    finally:
+        shutil.rmtree(copy)
+
+
+def count_reads(tree):
+    """
+    Count the reads of the given tree's data set while building, by wrapping
+    its take() and read() methods and the builder's per node row passes.
+
+    Returns:
+        A Counter of 'passes', the number of passes over the rows of a node,
+        and 'codes', the number of codes read.
+
+    """
+    counts = Counter()
+    take, read, chunks = tree.dataset.take, tree.dataset.read, tree._chunks
+
+    def counted_take(attr, rows):
+        counts['codes'] += len(rows)
+        return take(attr, rows)
+
+    def counted_read(attr, start, stop):
+        counts['codes'] += stop - start
+        return read(attr, start, stop)
+
+    def counted_chunks(rows, weights):
+        counts['passes'] += 1
+        return chunks(rows, weights)
+
+    tree.dataset.take, tree.dataset.read = counted_take, counted_read
+    tree._chunks = counted_chunks
+    return counts
+
+
+def tree_signature(tree):
+    """
+    Return the sorted rules of the given tree, and the label, majority,
+    split scores and branch weights of the node at the end of every path of
+    (attribute, value) pairs from the root. Scores and weights are rounded,
+    and branches sorted by value, so that trees built with the children of a
+    node in another order, or summing weights in another order, compare
+    equal.
+
+    """
+    nodes = {}
+    stack = [((), tree.root)]
+    while stack:
+        path, node = stack.pop()
+        nodes[path] = (
+            node.label, node.leaf, node.majority,
+            sorted((k, round(v, 9)) for k, v in node.properties.items()),
+            sorted((value, round(weight, 9)) for value, weight in
+                   zip(node.child_values, node.weights)))
+        for value, child in zip(node.child_values, node.children):
+            stack.append((path + ((node.label, value), ), child))
+    return sorted(tree.rules()), nodes
+
+
+def bench_compress(args):
+    """
+    Report the node and model size reduction from merging identical subtrees,
+    as well as the decision rate of the tree before and after.
+
+    """
+    print "{0:<42} {1:>7} {2:>7} {3:>9} {4:>9} {5:>10} {6:>10}".format(
+        'data set', 'nodes', 'dag', 'bytes', 'dag bytes', 'dec/s',
+        'dag dec/s')
+    for filename in args.datasets:
+        tree = id3.ID3(open(filename))
+        tree.create_tree()
+        rows = [[r[a] for a in tree.attributes] for r in tree.data]
+        rules, depth, leaves = tree.rules(), tree.depth, tree.num_leaves
+        size, rate = model_size(tree), decision_rate(tree, rows, args.repeat)
+
+        before, after = tree.compress()
+        assert (rules, depth, leaves) == (tree.rules(), tree.depth,
+                                          tree.num_leaves)
+        dag_size = model_size(tree)
+        dag_rate = decision_rate(tree, rows, args.repeat)
+        print ("{0:<42} {1:>7} {2:>7} {3:>9} {4:>9} {5:>10.0f} " +
+               "{6:>10.0f}").format(filename, before, after, size, dag_size,
+                                    rate, dag_rate)
+
+
+def bench_csv(args):
+    """
+    Report CSV load throughput of the row dictionary parser, the encoded
+    data set loader and the encoded data set cache.
+
+    """
+    path = scaled_copy(args.csv, args.scale)
+    try:
+        megabytes = os.path.getsize(path) / 1e6
+        _, legacy = timed(legacy_parse, open(path))
+        _, encoded = timed(dataset.EncodedDataset.from_csv, open(path))
+        _, numeric = timed(dataset.EncodedDataset.from_csv, open(path),
+                           infer_numeric=True)
+        timed(dataset.EncodedDataset.from_csv, open(path), cache=True)
+        _, cached = timed(dataset.EncodedDataset.from_csv, open(path),
+                          cache=True)
+    finally:
+        os.remove(path)
+        if os.path.exists(path + dataset.CACHE_EXTENSION):
+            os.remove(path + dataset.CACHE_EXTENSION)
+
+    print "{0} x{1}: {2:.1f} MB".format(args.csv, args.scale, megabytes)
+    for name, elapsed in [('row dictionaries', legacy),
+                          ('encoded', encoded),
+                          ('encoded, infer numeric', numeric),
+                          ('encoded, cached', cached)]:
+        print "{0:<24} {1:>8.3f} s {2:>10.1f} MB/s".format(
+            name, elapsed, megabytes / elapsed)
+
+
+def bench_missing(args):
+    """
+    Report build time, decision rate and accuracy with missing values, both
+    handled as missing and (as before) treated as one more category. Trees
+    are tested on a copy of the training data with other values missing.
+
+    """
+    clean = id3.ID3(open(args.csv))
+    rows = [[r[a] for a in clean.attributes] for r in clean.data]
+    expected = [r[clean.dependent] for r in clean.data]
+
+    print "{0}, {1:.0%} of training and test values missing".format(
+        args.csv, args.rate)
+    print "{0:<34} {1:>8} {2:>10} {3:>9}".format(
+        'training / strategy', 'build s', 'dec/s', 'accuracy')
+    path = with_missing(args.csv, args.rate)
+    test_path = with_missing(args.csv, args.rate, seed=1)
+    try:
+        test_rows = [[r[a] for a in clean.attributes] for r in
+                     id3.ID3(open(test_path), missing=()).data]
+        for name, tree, missing, strategy in [
+                ('no missing values', clean, None, 'distribute'),
+                ('? as a category', id3.ID3(open(path), missing=()), (),
+                 'distribute'),
+                ('fractional, distribute', id3.ID3(open(path)), None,
+                 'distribute'),
+                ('fractional, majority', id3.ID3(open(path)), None,
+                 'majority')]:
+            _, build = timed(tree.create_tree)
+            test = rows if missing is None and tree is clean else test_rows
+            decisions, elapsed = timed(tree.decide_batch,
+                                       test * args.repeat, strategy)
+            accuracy = sum(d == e for d, e in zip(decisions, expected))
+            print "{0:<34} {1:>8.3f} {2:>10.0f} {3:>9.1%}".format(
+                name, build, len(decisions) / elapsed,
+                float(accuracy) / len(expected))
+    finally:
+        os.remove(path)
+        os.remove(test_path)
+
+
+def bench_criteria(args):
+    """
+    Report build time and tree size per split criterion, building from the
+    same encoded data set each time.
+
+    """
+    print "{0:<42} {1:<18} {2:>8} {3:>7} {4:>7} {5:>6}".format(
+        'data set', 'criterion', 'build s', 'nodes', 'leaves', 'depth')
+    for filename in args.datasets:
+        tree = id3.ID3(open(filename))
+        for name in sorted(criteria.CRITERIA):
+            criterion = criteria.CRITERIA[name]()
+            build = min(timed(tree.create_tree, criterion)[1]
+                        for _ in xrange(args.repeat))
+            print "{0:<42} {1:<18} {2:>8.3f} {3:>7} {4:>7} {5:>6}".format(
+                filename, name, build, tree.num_nodes, tree.num_leaves,
+                tree.depth)
+
+
+def bench_memory(args):
+    """
+    Report training time and peak anonymous and file-backed memory on growing
+    copies of a CSV file, with the data set held in memory and read through
+    mmap from a converted directory. Conversion to the directory is measured
+    on its own, and the mmap runs then reuse it. Every run happens in a fresh
+    process.
+
+    The mmap training is also run in a memory cgroup limited to --limit
+    megabytes, on a copy of the code files made inside the cgroup so that
+    their page cache counts against the limit. Scales whose code files
+    outgrow the limit then show training on more data than the memory
+    available to it.
+
+    """
+    cgroup = memory_cgroup(args.limit)
+    if cgroup is None:
+        print "No memory cgroup available, skipping the limited runs."
+    print "{0:<6} {1:>9} {2:>8} {3:>9} {4:<13} {5:>9} {6:>8} {7:>8} " \
+        "{8:>8}".format('scale', 'rows', 'csv MB', 'codes MB', 'run',
+                        'limit MB', 'time s', 'anon MB', 'file MB')
+    try:
+        for scale in args.scales:
+            path = scaled_copy(args.csv, scale)
+            directory = tempfile.mkdtemp()
+            try:
+                megabytes = os.path.getsize(path) / 1e6
+                rows = sum(1 for _ in open(path)) - 1
+                runs = []
+                if not args.mmap_only:
+                    runs.append(('memory', None, train, (path, ), {}))
+                runs.extend([
+                    ('convert', None, dataset.MappedDataset.from_csv,
+                     (open(path), directory), {}),
+                    ('mmap', None, train, (path, ),
+                     {'mmap_dir': directory})])
+                if cgroup is not None:
+                    runs.append(('mmap copied', args.limit, train_copied,
+                                 (path, directory), {'cgroup': cgroup}))
+                results = []
+                for name, limit, func, func_args, kwargs in runs:
+                    try:
+                        result = "{0:>8.1f} {1:>8.1f} {2:>8.1f}".format(
+                            *peak_memory(func, *func_args, **kwargs))
+                    except RuntimeError:
+                        result = "{0:>8}".format('failed')
+                    results.append((name, limit, result))
+                codes = sum(os.path.getsize(os.path.join(directory, f))
+                            for f in os.listdir(directory)) / 1e6
+                for name, limit, result in results:
+                    print "{0:<6} {1:>9} {2:>8.1f} {3:>9.1f} {4:<13} " \
+                        "{5:>9} {6}".format(
+                            'x{0}'.format(scale), rows, megabytes, codes,
+                            name, '-' if limit is None else
+                            '{0:g}'.format(limit), result)
+            finally:
+                os.remove(path)
+                shutil.rmtree(directory)
+    finally:
+        if cgroup is not None:
+            os.rmdir(cgroup)
+
+
+def bench_levels(args):
+    """
+    Report build time and data set reads of the recursive and the level-wise
+    builder on growing copies of a CSV file, held in memory and read through
+    mmap. The recursive builder makes passes over the rows of each node, the
+    level-wise one a pass over the whole data set per level.
+
+    """
+    print "{0:<6} {1:>9} {2:<7} {3:<10} {4:>8} {5:>7} {6:>11}".format(
+        'scale', 'rows', 'storage', 'builder', 'build s', 'passes',
+        'codes read')
+    for scale in args.scales:
+        path = scaled_copy(args.csv, scale)
+        directory = tempfile.mkdtemp()
+        try:
+            for storage, mmap_dir in [('memory', None), ('mmap', directory)]:
+                tree = id3.ID3(open(path), mmap_dir=mmap_dir)
+                counts = count_reads(tree)
+                for name, build in [('recursive', tree.create_tree),
+                                    ('levelwise', tree.create_tree_levelwise)]:
+                    counts.clear()
+                    passes, elapsed = timed(build)
+                    print ("{0:<6} {1:>9} {2:<7} {3:<10} {4:>8.2f} {5:>7} " +
+                           "{6:>11}").format(
+                        'x{0}'.format(scale), tree.dataset.num_rows, storage,
+                        name, elapsed, passes or counts['passes'],
+                        counts['codes'])
+        finally:
+            os.remove(path)
+            shutil.rmtree(directory)
+
+
+def bench_distributed(args):
+    """
+    Report load and build time of a distributed tree over growing numbers
+    of local workers, the bytes sent each way while building, and the CPU
+    time of the busiest worker, which is about the build time given a core
+    per worker. The first row is the single process level-wise builder.
+
+    """
+    path = scaled_copy(args.csv, args.scale)
+    try:
+        tree = id3.ID3(open(path))
+    finally:
+        os.remove(path)
+    print "{0}, {1} rows, {2} cores".format(args.csv, tree.dataset.num_rows,
+                                            multiprocessing.cpu_count())
+    print "{0:<8} {1:>7} {2:>8} {3:>10} {4:>10} {5:>11}".format(
+        'workers', 'load s', 'build s', 'sent KB', 'recv KB', 'max cpu s')
+    _, elapsed = timed(tree.create_tree_levelwise)
+    rules = tree.rules()
+    print "{0:<8} {1:>7} {2:>8.2f}".format('-', '-', elapsed)
+
+    for num_workers in args.workers:
+        paths = sharded_copies(args.csv, args.scale, num_workers)
+        try:
+            distributed_tree, load = timed(distributed.DistributedTree.spawn,
+                                           paths)
+            try:
+                _, build = timed(distributed_tree.create_tree)
+                assert distributed_tree.rules() == rules
+                cpu = [s['cpu'] for s in distributed_tree.worker_stats()]
+                sent = distributed_tree.bytes_sent
+                received = distributed_tree.bytes_received
+            finally:
+                distributed_tree.close()
+        finally:
+            for path in paths:
+                os.remove(path)
+        print ("{0:<8} {1:>7.2f} {2:>8.2f} {3:>10.1f} {4:>10.1f} " +
+               "{5:>11.2f}").format(num_workers, load, build, sent / 1e3,
+                                    received / 1e3, max(cpu))
+
+
+def bench_builders(args):
+    """
+    Check that every tree builder creates the same tree as the recursive
+    in-memory one, per split criterion, on a copy of the data with missing
+    values so that fractional weights are exercised. Trees are compared by
+    rules and node weights (see tree_signature()). Also reports the build
+    time of each builder.
+
+    """
+    path = with_missing(args.csv, args.rate)
+    directory = tempfile.mkdtemp()
+    shards = sharded_copies(path, 1, args.workers)
+    distributed_tree = distributed.DistributedTree.spawn(shards)
+    try:
+        memory = id3.ID3(open(path))
+        mapped = id3.ID3(open(path), mmap_dir=directory)
+        print "{0} with {1:.0%} missing values, {2} rows".format(
+            args.csv, args.rate, memory.dataset.num_rows)
+        print "{0:<24} {1:<22} {2:>8} {3:>7}".format(
+            'criterion', 'builder', 'build s', 'nodes')
+        for name in sorted(criteria.CRITERIA):
+            criterion = criteria.CRITERIA[name]()
+            expected = None
+            for builder, tree, build in [
+                    ('recursive', memory, memory.create_tree),
+                    ('levelwise', memory, memory.create_tree_levelwise),
+                    ('mmap recursive', mapped, mapped.create_tree),
+                    ('mmap levelwise', mapped, mapped.create_tree_levelwise),
+                    ('distributed x{0}'.format(args.workers),
+                     distributed_tree, distributed_tree.create_tree)]:
+                _, elapsed = timed(build, criterion)
+                signature = tree_signature(tree)
+                if expected is None:
+                    expected = signature
+                assert signature == expected, (
+                    "{0} tree differs from the recursive tree".format(builder))
+                print "{0:<24} {1:<22} {2:>8.2f} {3:>7}".format(
+                    name, builder, elapsed, tree.num_nodes)
+    finally:
+        distributed_tree.close()
+        for shard in shards:
+            os.remove(shard)
+        shutil.rmtree(directory)
+        os.remove(path)
+    print "All builders create the same trees."
+
+
+def bench_swap(args):
+    """
+    Report the latency of swapping model versions into a registry while
+    decisions are made from it, and the decision rate meanwhile. Versions
+    alternate between trees built with two criteria, and every batch of
+    decisions is checked to match one of them entirely, so that no batch
+    mixes versions or sees a partially loaded tree.
+
+    """
+    trees = []
+    for name in ('information_gain', 'perfect_ratio'):
+        tree = id3.ID3(open(args.csv))
+        tree.create_tree(criteria.CRITERIA[name]())
+        trees.append(tree)
+    rows = [[r[a] for a in trees[0].attributes] for r in trees[0].data]
+    expected = [t.decide_batch(rows) for t in trees]
+    _, direct = timed(trees[0].decide_batch, rows)
+
+    directory = tempfile.mkdtemp()
+    models = registry.ModelRegistry(directory, keep=args.swaps + 1,
+                                    interval=args.interval)
+    last = '{0:04d}.model'.format(args.swaps)
+    try:
+        registry.publish(trees[0], directory, '0000.model')
+        models.start()
+
+        def publish():
+            for i in xrange(1, args.swaps + 1):
+                time.sleep(args.period)
+                registry.publish(trees[i % 2], directory,
+                                 '{0:04d}.model'.format(i))
+
+        publisher = threading.Thread(target=publish)
+        publisher.start()
+        batches, start = 0, time.time()
+        while publisher.is_alive() or models.current.name != last:
+            decisions = models.decide_batch(rows)
+            assert decisions in expected, "batch mixed model versions"
+            batches += 1
+        elapsed = time.time() - start
+        models.stop()
+        swapped = list(models.history)[1:]
+        _, rollback = timed(models.rollback)
+    finally:
+        models.stop()
+        shutil.rmtree(directory)
+
+    print "{0}: {1} versions published, {2} swapped in".format(
+        args.csv, args.swaps, len(swapped))
+    print "load s:            mean {0:.4f}  max {1:.4f}".format(
+        sum(v.load_seconds for v in swapped) / len(swapped),
+        max(v.load_seconds for v in swapped))
+    print ("write to swap s:   mean {0:.4f}  max {1:.4f}  (polling every " +
+           "{2} s)").format(sum(v.latency for v in swapped) / len(swapped),
+                            max(v.latency for v in swapped), args.interval)
+    print "rollback s:        {0:.6f}".format(rollback)
+    print "decisions/s:       {0:.0f} while swapping, {1:.0f} direct".format(
+        batches * len(rows) / elapsed, len(rows) / direct)
+    print "batches checked:   {0}, none mixed versions".format(batches)
+
+
+def bench_trace(args):
+    """
+    Report the decision rate with and without decision path tracing, on the
+    original rows and on rows with missing values, and the time taken to
+    compute feature importances. Rows ending in shared subtrees of a
+    compressed tree have their path rebuilt, so these are timed as well.
+
+    """
+    tree = id3.ID3(open(args.csv))
+    tree.create_tree()
+    rows = [[r[a] for a in tree.attributes] for r in tree.data]
+    path = with_missing(args.csv, args.rate)
+    try:
+        missing_rows = [[r[a] for a in tree.attributes] for r in
+                        id3.ID3(open(path), missing=()).data]
+    finally:
+        os.remove(path)
+
+    print "{0}, {1} rows".format(args.csv, len(rows) * args.repeat)
+    print "{0:<34} {1:>10} {2:>10} {3:>9}".format(
+        'rows / strategy', 'dec/s', 'traced/s', 'overhead')
+    for name, test, strategy in [
+            ('original', rows, 'distribute'),
+            ('{0:.0%} missing, distribute'.format(args.rate), missing_rows,
+             'distribute'),
+            ('{0:.0%} missing, majority'.format(args.rate), missing_rows,
+             'majority'),
+            ('original, compressed tree', rows, None)]:
+        if strategy is None:
+            tree.compress()
+            strategy = 'distribute'
+        test = test * args.repeat
+        plain = min(timed(tree.decide_batch, test, strategy)[1]
+                    for _ in xrange(3))
+        traced = min(timed(tree.decide_batch, test, strategy, True)[1]
+                     for _ in xrange(3))
+        print "{0:<34} {1:>10.0f} {2:>10.0f} {3:>9.1%}".format(
+            name, len(test) / plain, len(test) / traced, traced / plain - 1)
+
+    _, elapsed = timed(tree.feature_importances)
+    print "feature importances over {0} nodes: {1:.2f} ms".format(
+        tree.num_nodes, elapsed * 1000)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--datasets', nargs='+', default=DATASETS,
+                        help='.csv files to run the benchmarks on')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='number of passes over the data when timing')
+    subparsers = parser.add_subparsers()
+
+    compress_parser = subparsers.add_parser(
+        'compress', help='subtree compression ratio and decision rate')
+    compress_parser.set_defaults(func=bench_compress)
+
+    csv_parser = subparsers.add_parser(
+        'csv', help='CSV load throughput')
+    csv_parser.add_argument('--csv', default='example_data/nursery.csv',
+                            help='.csv file to scale up and load')
+    csv_parser.add_argument('--scale', type=int, default=20,
+                            help='number of copies of the .csv rows to load')
+    csv_parser.set_defaults(func=bench_csv)
+
+    missing_parser = subparsers.add_parser(
+        'missing', help='cost and accuracy of missing value handling')
+    missing_parser.add_argument(
+        '--csv', default='example_data/breast-cancer-wisconsin.csv',
+        help='.csv file to add missing values to')
+    missing_parser.add_argument('--rate', type=float, default=0.1,
+                                help='probability of each value being missing')
+    missing_parser.set_defaults(func=bench_missing)
+
+    criteria_parser = subparsers.add_parser(
+        'criteria', help='build time and tree size per split criterion')
+    criteria_parser.set_defaults(func=bench_criteria)
+
+    memory_parser = subparsers.add_parser(
+        'memory', help='peak memory of in-memory and mmap training')
+    memory_parser.add_argument('--csv', default='example_data/nursery.csv',
+                               help='.csv file to scale up and train on')
+    memory_parser.add_argument('--scales', type=int, nargs='+',
+                               default=[1, 10, 100, 400],
+                               help='numbers of copies of the .csv rows')
+    memory_parser.add_argument('--limit', type=float, default=32,
+                               help='megabytes of memory for the limited '
+                               'mmap runs')
+    memory_parser.add_argument('--mmap_only', action='store_true',
+                               help='skip training with the data in memory')
+    memory_parser.set_defaults(func=bench_memory)
+
+    levels_parser = subparsers.add_parser(
+        'levels', help='recursive and level-wise builder reads')
+    levels_parser.add_argument('--csv', default='example_data/nursery.csv',
+                               help='.csv file to scale up and train on')
+    levels_parser.add_argument('--scales', type=int, nargs='+',
+                               default=[1, 10, 50],
+                               help='numbers of copies of the .csv rows')
+    levels_parser.set_defaults(func=bench_levels)
+
+    distributed_parser = subparsers.add_parser(
+        'distributed', help='distributed training over local workers')
+    distributed_parser.add_argument(
+        '--csv', default='example_data/nursery.csv',
+        help='.csv file to scale up and shard')
+    distributed_parser.add_argument('--scale', type=int, default=20,
+                                    help='number of copies of the .csv rows')
+    distributed_parser.add_argument('--workers', type=int, nargs='+',
+                                    default=[1, 2, 4],
+                                    help='numbers of workers to shard over')
+    distributed_parser.set_defaults(func=bench_distributed)
+
+    builders_parser = subparsers.add_parser(
+        'builders', help='check every tree builder creates the same tree')
+    builders_parser.add_argument('--csv', default='example_data/nursery.csv',
+                                 help='.csv file to add missing values to')
+    builders_parser.add_argument('--rate', type=float, default=0.1,
+                                 help='probability of each value being '
+                                 'missing')
+    builders_parser.add_argument('--workers', type=int, default=3,
+                                 help='number of distributed workers')
+    builders_parser.set_defaults(func=bench_builders)
+
+    swap_parser = subparsers.add_parser(
+        'swap', help='model registry swap latency under decisions')
+    swap_parser.add_argument('--csv', default='example_data/nursery.csv',
+                             help='.csv file to train and decide on')
+    swap_parser.add_argument('--swaps', type=int, default=20,
+                             help='number of model versions to publish')
+    swap_parser.add_argument('--period', type=float, default=0.2,
+                             help='seconds between published versions')
+    swap_parser.add_argument('--interval', type=float, default=0.05,
+                             help='seconds between registry polls')
+    swap_parser.set_defaults(func=bench_swap)
+
+    trace_parser = subparsers.add_parser(
+        'trace', help='decision path tracing overhead')
+    trace_parser.add_argument('--csv', default='example_data/nursery.csv',
+                              help='.csv file to train and decide on')
+    trace_parser.add_argument('--rate', type=float, default=0.1,
+                              help='probability of each value being missing')
+    trace_parser.set_defaults(func=bench_trace)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,168 @@
+"""
+Implements the split criteria used to choose decision attributes during
+decision tree construction.
+
+Every criterion scores a split from its contingency table (see
+DTree.contingency()): one list of weighted dependent value counts per value of
+the split attribute, followed by the counts of rows where it is missing. As
+in C4.5, missing rows are left out of the score, which is then scaled by the
+fraction of rows that are known.
+
+"""
+
+import math
+
+
+class Criterion(object):
+    """
+    A split criterion. Subclasses implement known_score() and set name, which
+    is the node property the score is stored under.
+
+    """
+
+    name = None
+
+    def score(self, table):
+        """
+        Score the split described by the given contingency table. Higher
+        scores are better.
+
+        Args:
+            table: the weighted class counts per value of the split attribute,
+                followed by the class counts of rows missing it.
+        Returns:
+            A float score of the split.
+
+        """
+        known = table[:-1]
+        known_total = sum(sum(c) for c in known)
+        total = known_total + sum(table[-1])
+        return self.known_score(known) * known_total / total
+
+    def known_score(self, known):
+        """
+        Score a split using only the rows where the split attribute is known.
+
+        Args:
+            known: the weighted class counts per value of the split
+                attribute.
+        Returns:
+            A float score of the split.
+
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return self.name
+
+
+class InformationGain(Criterion):
+    """
+    The reduction in entropy of the dependent variable, as used by ID3.
+
+    """
+
+    name = 'information_gain'
+
+    def known_score(self, known):
+        sizes = [sum(c) for c in known]
+        total = sum(sizes)
+        gain = entropy([sum(c) for c in zip(*known)])
+        for size, counts in zip(sizes, known):
+            if size:
+                gain -= (size / total) * entropy(counts)
+        return gain
+
+
+class GainRatio(InformationGain):
+    """
+    Information gain divided by the entropy of the split itself, as used by
+    C4.5, which offsets the bias of information gain toward attributes with
+    many values.
+
+    """
+
+    name = 'gain_ratio'
+
+    def score(self, table):
+        split_info = entropy([sum(c) for c in table])
+        if not split_info:
+            return 0.
+        return InformationGain.score(self, table) / split_info
+
+
+class Gini(Criterion):
+    """
+    The reduction in Gini impurity of the dependent variable, as used by
+    CART.
+
+    """
+
+    name = 'gini'
+
+    def known_score(self, known):
+        sizes = [sum(c) for c in known]
+        total = sum(sizes)
+        gain = gini([sum(c) for c in zip(*known)])
+        for size, counts in zip(sizes, known):
+            if size:
+                gain -= (size / total) * gini(counts)
+        return gain
+
+
+class PerfectClassification(Criterion):
+    """
+    The fraction of rows belonging to attribute values which perfectly
+    classify the dependent variable, as used by factorial analysis.
+
+    """
+
+    name = 'perfect_ratio'
+
+    def known_score(self, known):
+        perfect = 0.
+        total = 0.
+        for counts in known:
+            total += sum(counts)
+            if sum(1 for c in counts if c) == 1:
+                # Only one dependent value found; perfect classification
+                perfect += sum(counts)
+        return perfect / total
+
+
+CRITERIA = dict((c.name, c) for c in (InformationGain, GainRatio, Gini,
+                                      PerfectClassification))
+
+
+def entropy(counts):
+    """
+    Calculate the entropy of the given (weighted) dependent value counts.
+
+    Args:
+        counts: an iterable of counts per dependent value.
+    Returns:
+        A float of the entropy of the counts.
+
+    """
+    total = float(sum(counts))
+    result = 0.
+    for count in counts:
+        if count:
+            proportion = count / total
+            result -= proportion * math.log(proportion, 2)
+    return result
+
+
+def gini(counts):
+    """
+    Calculate the Gini impurity of the given (weighted) dependent value
+    counts.
+
+    Args:
+        counts: an iterable of counts per dependent value.
+    Returns:
+        A float of the Gini impurity of the counts.
+
+    """
+    total = float(sum(counts))
+    return 1. - sum((count / total) ** 2 for count in counts)
@@ -0,0 +1,667 @@
+"""
+Implements a column oriented, integer encoded data set which is bulk loaded
+from CSV files, to be used in decision tree construction algorithms.
+
+"""
+
+import array
+import bisect
+import cPickle
+import csv
+import itertools
+import mmap
+import operator
+import os
+import tempfile
+
+CACHE_EXTENSION = '.dtcache'
+MISSING = ('?', '')
+MISSING_CODE = -1
+
+
+class EncodedDataset(object):
+    """
+    A data set stored as one array of integer codes per attribute, where each
+    code indexes into the list of distinct values of that attribute. Missing
+    values are stored as MISSING_CODE and are not distinct values.
+
+    """
+
+    def __init__(self, header, attributes, dependent):
+        """
+        Initialize an empty data set.
+
+        Args:
+            header: the full list of column names of the source CSV file.
+            attributes: the columns kept in the data set, in file order.
+            dependent: the name of the dependent variable.
+
+        """
+        self.header = header
+        self.attributes = attributes
+        self.dependent = dependent
+        self.values = dict((a, []) for a in attributes)
+        self.types = dict((a, str) for a in attributes)
+        self.codes = dict((a, array.array('i')) for a in attributes)
+        self.num_rows = 0
+
+    @classmethod
+    def from_csv(cls, csv_file, dependent_index=-1, columns=None,
+                 infer_numeric=False, missing=MISSING, cache=False,
+                 chunk_size=65536):
+        """
+        Parse the given CSV file in chunks of rows, encoding each kept column
+        and collecting its distinct values in the same pass.
+
+        Args:
+            csv_file: CSV file following the format specified in README. This
+                function will automatically close the file after usage.
+            dependent_index: the column index of the dependent variable
+                (default -1).
+            columns: the names of the independent columns to keep (default
+                None, which keeps every column).
+            infer_numeric: whether or not to convert the values of columns
+                that are entirely numeric to ints or floats (default False).
+            missing: the field values which mark a missing value (default
+                MISSING).
+            cache: whether or not to store the encoded data set next to the
+                CSV file and reuse it while the file is unchanged (default
+                False).
+            chunk_size: the number of rows encoded at a time (default 65536).
+        Returns:
+            An EncodedDataset instance holding the CSV data.
+        Raises:
+            ValueError: if a row does not have as many fields as the header.
+
+        """
+        cache_path = cache_key = None
+        if cache and os.path.isfile(getattr(csv_file, 'name', '')):
+            stat = os.stat(csv_file.name)
+            cache_path = csv_file.name + CACHE_EXTENSION
+            cache_key = (stat.st_mtime, stat.st_size, dependent_index,
+                         columns and tuple(columns), infer_numeric,
+                         tuple(missing))
+            dataset = cls.load(cache_path, cache_key)
+            if dataset is not None:
+                csv_file.close()
+                return dataset
+
+        reader = csv.reader(csv_file)
+        header = reader.next()
+        dataset = cls(header, *select_columns(header, dependent_index,
+                                              columns))
+        dataset.read_rows(reader, missing, chunk_size)
+        csv_file.close()
+
+        if infer_numeric:
+            dataset.infer_numeric()
+        if cache_path is not None:
+            dataset.save(cache_path, cache_key)
+        return dataset
+
+    def read_rows(self, reader, missing=MISSING, chunk_size=65536):
+        """
+        Encode the rows of the given CSV reader in chunks, appending their
+        codes to the data set and collecting distinct values in the same
+        pass.
+
+        Args:
+            reader: a CSV reader positioned after the header row.
+            missing: the field values which mark a missing value (default
+                MISSING).
+            chunk_size: the number of rows encoded at a time (default 65536).
+        Raises:
+            ValueError: if a row does not have as many fields as the header.
+
+        """
+        keep = [self.header.index(a) for a in self.attributes]
+        encoders = [dict.fromkeys(missing, MISSING_CODE) for _ in keep]
+        for value_list, encoder in zip((self.values[a] for a in
+                                        self.attributes), encoders):
+            encoder.update((v, i) for i, v in enumerate(value_list))
+        while True:
+            chunk = filter(None, itertools.islice(reader, chunk_size))
+            if not chunk:
+                break
+            if set(map(len, chunk)) != set([len(self.header)]):
+                raise ValueError("row length does not match CSV header")
+            for i, encoder in zip(keep, encoders):
+                # Pulling out one column at a time is much cheaper than
+                # transposing the whole chunk, and skips unused columns
+                field = map(operator.itemgetter(i), chunk)
+                values = self.values[self.header[i]]
+                for value in set(field).difference(encoder):
+                    encoder[value] = len(values)
+                    values.append(value)
+                self.codes[self.header[i]].fromlist(
+                    map(encoder.__getitem__, field)
+                )
+            self.num_rows += len(chunk)
+
+    def take(self, attr, rows):
+        """
+        Get the codes of the given attribute at the given rows.
+
+        Args:
+            attr: the selected attribute.
+            rows: an ascending sequence of row indices.
+        Returns:
+            A list of codes, one per row.
+
+        """
+        return map(self.codes[attr].__getitem__, rows)
+
+    def read(self, attr, start, stop):
+        """
+        Get the codes of the given attribute over a contiguous range of rows.
+
+        Args:
+            attr: the selected attribute.
+            start: the index of the first row.
+            stop: the index after the last row.
+        Returns:
+            An array of codes.
+
+        """
+        return self.codes[attr][start:stop]
+
+    def new_array(self, typecode, spill=None):
+        """
+        Return an empty array of the given typecode for holding a subset of
+        rows (or their weights) of the data set.
+
+        Args:
+            typecode: the typecode of the array.
+            spill: a spill file from new_spill() shared by the arrays of
+                the partitions of a node (default None).
+
+        """
+        return array.array(typecode)
+
+    def new_spill(self):
+        """
+        Return the storage shared by the arrays of the partitions of a node
+        (see new_array()), which is None for data sets held in memory.
+
+        """
+        return None
+
+    def infer_numeric(self):
+        """
+        Convert the values of every column whose values are all integers or
+        all numbers to ints or floats respectively. Only the distinct values
+        are converted, so the codes are left untouched.
+
+        """
+        for attr in self.attributes:
+            for convert in (int, float):
+                try:
+                    values = [convert(v) for v in self.values[attr]]
+                except ValueError:
+                    continue
+                if len(set(values)) == len(values):  # e.g. '1' and '1.0'
+                    self.values[attr] = values
+                    self.types[attr] = convert
+                break
+
+    def recode(self, values):
+        """
+        Re-encode the data set against the given distinct values, so that
+        data sets loaded separately (e.g. shards of one data set) share their
+        codes.
+
+        Args:
+            values: a dictionary of the list of distinct values of each
+                attribute, which must include every value of the data set.
+
+        """
+        for attr in self.attributes:
+            index = dict((v, i) for i, v in enumerate(values[attr]))
+            # MISSING_CODE indexes the trailing MISSING_CODE
+            lookup = [index[v] for v in self.values[attr]] + [MISSING_CODE]
+            self.codes[attr] = array.array(
+                'i', map(lookup.__getitem__, self.codes[attr]))
+            self.values[attr] = values[attr]
+
+    def rows(self):
+        """
+        Decode the data set into rows.
+
+        Returns:
+            A list of row dictionaries keyed by attribute, with None for
+            missing values.
+
+        """
+        # MISSING_CODE indexes the trailing None
+        columns = [map((self.values[a] + [None]).__getitem__, self.codes[a])
+                   for a in self.attributes]
+        return [dict(zip(self.attributes, r)) for r in zip(*columns)]
+
+    def save(self, path, key=None):
+        """
+        Write the data set to the given path, replacing any existing file
+        only once the new one is complete.
+
+        Args:
+            path: the path of the file to write.
+            key: an object identifying the source of the data set, checked
+                by load() (default None).
+
+        """
+        state = {
+            'key': key,
+            'header': self.header,
+            'attributes': self.attributes,
+            'dependent': self.dependent,
+            'values': self.values,
+            'types': self.types,
+            'codes': dict((a, c.tostring()) for a, c in self.codes.items()),
+            'num_rows': self.num_rows,
+        }
+        with open(path + '.tmp', 'wb') as f:
+            cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, key=None):
+        """
+        Read a data set written by save().
+
+        Args:
+            path: the path of the file to read.
+            key: the key the data set must have been saved with (default
+                None).
+        Returns:
+            An EncodedDataset instance, or None if the file does not exist or
+            was saved with a different key.
+
+        """
+        try:
+            with open(path, 'rb') as f:
+                state = cPickle.load(f)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return None
+        if state['key'] != key:
+            return None
+
+        dataset = cls(state['header'], state['attributes'],
+                      state['dependent'])
+        dataset.values = state['values']
+        dataset.types = state['types']
+        for attr, codes in state['codes'].items():
+            dataset.codes[attr].fromstring(codes)
+        dataset.num_rows = state['num_rows']
+        return dataset
+
+
+class MappedDataset(EncodedDataset):
+    """
+    An encoded data set whose codes are stored in one binary file per
+    attribute and read through mmap, so that training can work on data sets
+    larger than memory. Row subsets created for it spill to temporary files.
+
+    """
+
+    @classmethod
+    def from_csv(cls, csv_file, directory, dependent_index=-1, columns=None,
+                 infer_numeric=False, missing=MISSING, chunk_size=65536):
+        """
+        Convert the given CSV file into code files in the given directory,
+        reading and writing it in chunks of rows, and open the result. A
+        directory already converted from the unchanged file with the same
+        options is reused.
+
+        Args:
+            csv_file: CSV file following the format specified in README. This
+                function will automatically close the file after usage.
+            directory: the directory to store the code files in, which is
+                created if needed.
+            dependent_index, columns, infer_numeric, missing, chunk_size: see
+                EncodedDataset.from_csv().
+        Returns:
+            A MappedDataset instance holding the CSV data.
+        Raises:
+            ValueError: if a row does not have as many fields as the header.
+
+        """
+        key = None
+        if os.path.isfile(getattr(csv_file, 'name', '')):
+            stat = os.stat(csv_file.name)
+            key = (stat.st_mtime, stat.st_size, dependent_index,
+                   columns and tuple(columns), infer_numeric, tuple(missing))
+            dataset = cls.open(directory, key)
+            if dataset is not None:
+                csv_file.close()
+                return dataset
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        reader = csv.reader(csv_file)
+        header = reader.next()
+        dataset = EncodedDataset(header, *select_columns(
+            header, dependent_index, columns))
+        dataset.codes = dict(
+            (a, _ColumnWriter(os.path.join(directory, '{0}.codes'.format(i))))
+            for i, a in enumerate(dataset.attributes)
+        )
+        dataset.read_rows(reader, missing, chunk_size)
+        csv_file.close()
+        if infer_numeric:
+            dataset.infer_numeric()
+
+        state = {
+            'key': key,
+            'header': dataset.header,
+            'attributes': dataset.attributes,
+            'dependent': dataset.dependent,
+            'values': dataset.values,
+            'types': dataset.types,
+            'files': dict((a, (os.path.basename(c.path), c.close()))
+                          for a, c in dataset.codes.items()),
+            'num_rows': dataset.num_rows,
+        }
+        path = os.path.join(directory, 'meta')
+        with open(path + '.tmp', 'wb') as f:
+            cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(path + '.tmp', path)
+        return cls.open(directory, key)
+
+    @classmethod
+    def open(cls, directory, key=None):
+        """
+        Open a directory of code files written by from_csv().
+
+        Args:
+            directory: the directory holding the code files.
+            key: the key the directory must have been written with (default
+                None).
+        Returns:
+            A MappedDataset instance, or None if the directory has not been
+            converted or was converted with a different key.
+
+        """
+        try:
+            with open(os.path.join(directory, 'meta'), 'rb') as f:
+                state = cPickle.load(f)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return None
+        if state['key'] != key:
+            return None
+
+        dataset = cls(state['header'], state['attributes'],
+                      state['dependent'])
+        dataset.values = state['values']
+        dataset.types = state['types']
+        dataset.num_rows = state['num_rows']
+        dataset.codes = dict(
+            (a, MappedColumn(os.path.join(directory, name), typecode,
+                             dataset.num_rows))
+            for a, (name, typecode) in state['files'].items()
+        )
+        return dataset
+
+    def take(self, attr, rows):
+        return self.codes[attr].take(rows)
+
+    def read(self, attr, start, stop):
+        return self.codes[attr].read(start, stop)
+
+    def new_array(self, typecode, spill=None):
+        return SpillArray(typecode, spill)
+
+    def new_spill(self):
+        return SpillFile()
+
+
+class MappedColumn(object):
+    """
+    An array of codes stored in a binary file and read through mmap. Reads
+    copy out only the pages spanned by the requested rows, which the OS is
+    free to evict again.
+
+    """
+
+    # The largest span of rows copied out of the mapping in one read
+    window = 65536
+
+    def __init__(self, path, typecode, length):
+        """
+        Map the given code file.
+
+        Args:
+            path: the path of the code file.
+            typecode: the array typecode the codes are stored with.
+            length: the number of codes in the file.
+
+        """
+        self.path = path
+        self.typecode = typecode
+        self.length = length
+        self.itemsize = array.array(typecode).itemsize
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def take(self, rows):
+        """
+        Get the codes at the given ascending row indices, copying them out
+        of the mapping one window of rows at a time.
+
+        """
+        codes = []
+        start = 0
+        while start < len(rows):
+            low = rows[start]
+            end = bisect.bisect_left(rows, low + self.window, start)
+            window = array.array(self.typecode, self.map[
+                low * self.itemsize:(rows[end - 1] + 1) * self.itemsize])
+            codes.extend(map(window.__getitem__, itertools.imap(
+                operator.sub, rows[start:end], itertools.repeat(low))))
+            start = end
+        return codes
+
+    def read(self, start, stop):
+        """
+        Get the codes of a contiguous range of rows as an array.
+
+        """
+        return array.array(self.typecode,
+                           self.map[start * self.itemsize:
+                                    stop * self.itemsize])
+
+    def __iter__(self):
+        for low in xrange(0, self.length, self.window):
+            for code in self.read(low, min(low + self.window, self.length)):
+                yield code
+
+    def __len__(self):
+        return self.length
+
+
+class SpillFile(object):
+    """
+    An anonymous temporary file shared by the SpillArrays of the partitions
+    of a node, so that splitting a node uses at most one file descriptor. The
+    file is only created once a partition outgrows its buffer.
+
+    """
+
+    def __init__(self):
+        self.file = None
+
+    def write(self, values):
+        """
+        Append the given array to the file.
+
+        Returns:
+            The byte offset the array was written at.
+
+        """
+        if self.file is None:
+            self.file = tempfile.TemporaryFile()
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        values.tofile(self.file)
+        return offset
+
+    def read(self, typecode, offset, count):
+        """
+        Return an array of count values of the given typecode read from the
+        given byte offset.
+
+        """
+        self.file.seek(offset)
+        values = array.array(typecode)
+        values.fromfile(self.file, count)
+        return values
+
+
+class SpillArray(object):
+    """
+    An append-only array of which only the latest appends are buffered in
+    memory, the rest being written in blocks to a SpillFile. Reading is done
+    by slicing.
+
+    """
+
+    buffer_size = 8192
+
+    def __init__(self, typecode, spill=None):
+        """
+        Args:
+            typecode: the typecode of the values.
+            spill: the SpillFile to write full buffers to (default None,
+                which uses a new one).
+
+        """
+        self.typecode = typecode
+        self.itemsize = array.array(typecode).itemsize
+        self.spill = SpillFile() if spill is None else spill
+        self.buffer = array.array(typecode)
+        self.blocks = []
+        self.stored = 0
+
+    def append(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def extend(self, values):
+        self.buffer.extend(values)
+        while len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the first buffer_size buffered values to the spill file as a
+        new block.
+
+        """
+        self.blocks.append(self.spill.write(self.buffer[:self.buffer_size]))
+        self.stored += self.buffer_size
+        del self.buffer[:self.buffer_size]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError("SpillArray only supports slicing")
+        start, stop, _ = index.indices(len(self))
+        values = array.array(self.typecode)
+        # Every block holds buffer_size values
+        while start < min(stop, self.stored):
+            block, skip = divmod(start, self.buffer_size)
+            count = min(stop - start, self.buffer_size - skip)
+            values.extend(self.spill.read(
+                self.typecode, self.blocks[block] + skip * self.itemsize,
+                count))
+            start += count
+        if stop > start:
+            values.extend(self.buffer[start - self.stored:stop - self.stored])
+        return values
+
+    def __getslice__(self, start, stop):
+        # Negative indices have already been offset by len(self)
+        return self.__getitem__(slice(max(start, 0), max(stop, 0)))
+
+    def __iter__(self):
+        for low in xrange(0, len(self), self.buffer_size):
+            for value in self[low:low + self.buffer_size]:
+                yield value
+
+    def __len__(self):
+        return self.stored + len(self.buffer)
+
+
+class _ColumnWriter(object):
+    """
+    Appends codes to a code file while converting a CSV file.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.max_code = MISSING_CODE
+
+    def fromlist(self, codes):
+        array.array('i', codes).tofile(self.file)
+        self.max_code = max(self.max_code, max(codes))
+
+    def close(self):
+        """
+        Close the code file, rewriting it with the narrowest typecode which
+        holds every code.
+
+        Returns:
+            The typecode of the code file.
+
+        """
+        self.file.close()
+        for typecode in ('b', 'h'):
+            if self.max_code < 2 ** (array.array(typecode).itemsize * 8 - 1):
+                break
+        else:
+            return 'i'
+
+        with open(self.path, 'rb') as wide:
+            with open(self.path + '.tmp', 'wb') as narrow:
+                while True:
+                    codes = array.array('i', wide.read(4 * 65536))
+                    if not codes:
+                        break
+                    array.array(typecode, codes).tofile(narrow)
+        os.rename(self.path + '.tmp', self.path)
+        return typecode
+
+
+def select_columns(header, dependent_index=-1, columns=None):
+    """
+    Select the attributes kept from a CSV header.
+
+    Args:
+        header: the full list of column names of the CSV file.
+        dependent_index: the column index of the dependent variable
+            (default -1).
+        columns: the names of the independent columns to keep (default None,
+            which keeps every column).
+    Returns:
+        A tuple of the kept attributes, in file order, and the dependent
+        variable.
+    Raises:
+        ValueError: if dependent_index is out of range, or columns names a
+            column missing from the header or the dependent variable.
+
+    """
+    if not -len(header) <= dependent_index < len(header):
+        raise ValueError("dependent_index {0} is out of range for {1} "
+                         "columns".format(dependent_index, len(header)))
+    dependent = header[dependent_index]
+    if columns is not None:
+        unknown = [c for c in columns if c not in header]
+        if unknown:
+            raise ValueError("unknown columns: {0}".format(
+                ', '.join(unknown)))
+        if dependent in columns:
+            raise ValueError("the dependent variable {0} cannot also be an "
+                             "independent column".format(dependent))
+    attributes = [a for a in header
+                  if columns is None or a in columns or a == dependent]
+    return attributes, dependent
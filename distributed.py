@@ -0,0 +1,473 @@
+"""
+Implements data parallel decision tree construction, where the training rows
+are sharded across worker processes and a coordinating tree chooses the
+splits from the count tables the workers send it. Rows never leave the
+workers.
+
+Workers run either as local processes started by DistributedTree.spawn(), or
+on other machines, connecting to a coordinator started with
+DistributedTree.listen() over a socket.
+
+"""
+
+import array
+import cPickle
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+import time
+import traceback
+
+import criteria
+import dataset
+import dtree
+
+
+class WorkerError(Exception):
+    """
+    Raised by the coordinator when a worker failed to handle a request. The
+    message is the traceback of the worker.
+
+    """
+    pass
+
+
+class Worker(object):
+    """
+    The worker side of distributed construction, holding one shard of the
+    training rows.
+
+    """
+
+    # The requests a coordinator may make
+    commands = ('describe', 'recode', 'count', 'stats')
+
+    def __init__(self, shard_file, dependent_index=-1, columns=None,
+                 missing=dataset.MISSING):
+        """
+        Load the given shard of the training rows.
+
+        Args:
+            shard_file: the filename of a CSV file following the format
+                specified in README.
+            dependent_index, columns, missing: see DTree.parse_csv(). Every
+                shard must be loaded with the same columns.
+
+        """
+        self.tree = dtree.DTree(open(shard_file), dependent_index, columns,
+                                missing=missing)
+        self.assignment = None
+        self.shared = None
+        self.cpu = 0.
+
+    def describe(self):
+        """
+        Return the header, kept attributes, dependent variable, distinct
+        values and number of rows of the shard.
+
+        """
+        data_set = self.tree.dataset
+        return (data_set.header, data_set.attributes, data_set.dependent,
+                data_set.values, data_set.num_rows)
+
+    def recode(self, values):
+        """
+        Re-encode the shard against the distinct values of every shard.
+
+        """
+        self.tree.dataset.recode(values)
+        self.tree.get_distinct_values()
+
+    def count(self, frontier, previous):
+        """
+        Make a pass over the shard for a level of the tree (see
+        DTree.level_pass()).
+
+        Args:
+            frontier: a (remaining, counts, scored) tuple per node of the
+                level.
+            previous: a (split, children, fractions) tuple per node of the
+                previous level, or None for the root level, which starts a
+                new tree.
+        Returns:
+            A list of the contingency tables and class totals of the shard
+            for each scored node of the level, or None for the others.
+
+        """
+        if previous is None:
+            self.assignment = array.array('i')
+            self.shared = dtree.SharedRows(self.tree.dataset)
+        else:
+            previous = [self._pending(None, split=s, children=c, fractions=f)
+                        for s, c, f in previous]
+        frontier = [self._pending(r, counts=c, scored=s)
+                    for r, c, s in frontier]
+        self.tree.level_pass(frontier, previous, self.assignment,
+                             self.shared)
+        return [(p.tables, p.totals) if p.scored else None for p in frontier]
+
+    def stats(self):
+        """
+        Return the number of rows of the shard and the CPU seconds spent
+        handling requests.
+
+        """
+        return {'rows': self.tree.dataset.num_rows, 'cpu': self.cpu}
+
+    def _pending(self, remaining, **fields):
+        pending = dtree.PendingNode(None, None, remaining)
+        pending.__dict__.update(fields)
+        return pending
+
+
+class DistributedTree(dtree.DTree):
+    """
+    A decision tree built level by level (see DTree.create_tree_levelwise())
+    over training rows sharded across workers. For every level, each worker
+    counts its rows into the contingency tables of the frontier nodes and
+    sends them back, and the tree sums them to choose the splits it sends
+    out with the next level.
+
+    """
+
+    def __init__(self, connections, infer_numeric=False,
+                 missing=dataset.MISSING, processes=()):
+        """
+        Initialize the tree from connected workers, merging the distinct
+        values of their shards and having them re-encode their rows to match.
+
+        Args:
+            connections: a multiprocessing Connection to each worker.
+            infer_numeric: whether or not to convert entirely numeric columns
+                to ints or floats (default False).
+            missing: the field values which mark a missing value (default
+                dataset.MISSING). Only used when deciding, as workers mark
+                missing values themselves.
+            processes: the local worker processes, joined by close() (default
+                no processes).
+        Raises:
+            ValueError: if the shards do not have the same columns.
+
+        """
+        self.connections = connections
+        self.processes = list(processes)
+        self.num_workers = len(connections)
+        self.training_file = None
+        self.root = None
+        self.criterion_name = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+        shards = self._broadcast('describe')
+        header, attributes, dependent = shards[0][:3]
+        if any(s[:3] != shards[0][:3] for s in shards):
+            raise ValueError("shards do not have the same columns")
+        data_set = dataset.EncodedDataset(header, attributes, dependent)
+        for attr in attributes:
+            seen = set()
+            for shard in shards:
+                for value in shard[3][attr]:
+                    if value not in seen:
+                        seen.add(value)
+                        data_set.values[attr].append(value)
+        data_set.num_rows = sum(s[4] for s in shards)
+        self._broadcast('recode', data_set.values)
+        if infer_numeric:
+            data_set.infer_numeric()
+
+        self.set_dataset(data_set, missing)
+        self.get_distinct_values()
+
+    @classmethod
+    def spawn(cls, shard_files, dependent_index=-1, columns=None,
+              infer_numeric=False, missing=dataset.MISSING):
+        """
+        Start a local worker process for each of the given shards and
+        initialize a tree from them.
+
+        Args:
+            shard_files: the filenames of the CSV files of each shard.
+            dependent_index, columns, missing: see Worker.
+            infer_numeric: see DistributedTree.
+        Returns:
+            A DistributedTree instance.
+
+        """
+        connections, processes = [], []
+        for shard_file in shard_files:
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=serve,
+                args=(worker_connection, shard_file, dependent_index, columns,
+                      missing)
+            )
+            process.daemon = True
+            process.start()
+            worker_connection.close()
+            connections.append(connection)
+            processes.append(process)
+        try:
+            return cls(connections, infer_numeric, missing, processes)
+        except Exception:
+            for process in processes:
+                process.terminate()
+            raise
+
+    @classmethod
+    def listen(cls, address, num_workers, authkey, infer_numeric=False,
+               missing=dataset.MISSING):
+        """
+        Wait for the given number of workers to connect (see connect()) and
+        initialize a tree from them.
+
+        Args:
+            address: the (host, port) tuple to listen on.
+            num_workers: the number of workers to wait for.
+            authkey: the key workers authenticate with.
+            infer_numeric, missing: see DistributedTree.
+        Returns:
+            A DistributedTree instance.
+
+        """
+        listener = Listener(address, authkey=authkey)
+        try:
+            connections = [listener.accept() for _ in xrange(num_workers)]
+        finally:
+            listener.close()
+        return cls(connections, infer_numeric, missing)
+
+    def create_tree(self, criterion=None):
+        """
+        Create the decision tree across the workers. Trees can only be built
+        level by level, see create_tree_levelwise().
+
+        """
+        return self.create_tree_levelwise(criterion)
+
+    def level_pass(self, frontier, previous, assignment, shared):
+        """
+        Have every worker make a pass over its shard for the given level (see
+        DTree.level_pass()) and sum their contingency tables and class
+        totals. Rows are assigned to nodes on the workers, so assignment and
+        shared are left untouched.
+
+        """
+        replies = self._broadcast(
+            'count',
+            [(p.remaining, p.counts, p.scored) for p in frontier],
+            previous and [(p.split, p.children, p.fractions)
+                          for p in previous]
+        )
+        num_classes = len(self.dataset.values[self.dependent])
+        for pending, counted in zip(frontier, zip(*replies)):
+            if not pending.scored:
+                continue
+            pending.tables = self.empty_tables(pending.remaining)
+            if pending.counts is None:
+                pending.totals = [0.] * num_classes
+            for tables, totals in counted:
+                for table, shard_table in zip(pending.tables, tables):
+                    for counts, shard_counts in zip(table, shard_table):
+                        for d, count in enumerate(shard_counts):
+                            counts[d] += count
+                if pending.counts is None:
+                    for d, count in enumerate(totals):
+                        pending.totals[d] += count
+
+    def worker_stats(self):
+        """
+        Return the stats of each worker (see Worker.stats()).
+
+        """
+        return self._broadcast('stats')
+
+    def close(self):
+        """
+        Stop the workers and wait for local worker processes to exit.
+
+        """
+        for connection in self.connections:
+            connection.send_bytes(cPickle.dumps(None))
+            connection.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+    def _broadcast(self, command, *args):
+        """
+        Send a request to every worker, which then handle it in parallel,
+        and return their replies.
+
+        Raises:
+            WorkerError: if any worker failed.
+
+        """
+        request = cPickle.dumps((command,) + args, cPickle.HIGHEST_PROTOCOL)
+        for connection in self.connections:
+            connection.send_bytes(request)
+            self.bytes_sent += len(request)
+        replies = []
+        for connection in self.connections:
+            reply = connection.recv_bytes()
+            self.bytes_received += len(reply)
+            replies.append(cPickle.loads(reply))
+        # Every reply is received first, so that the workers stay in step
+        for reply in replies:
+            if isinstance(reply, WorkerError):
+                raise reply
+        return replies
+
+    def __str__(self):
+        return ("distributed decision tree over {0} workers:\n" +
+                "Dependent variable: {1}\n{2}").format(
+            self.num_workers, self.dependent, self.root)
+
+    def __repr__(self):
+        return ("distributed decision tree over {0} workers:\n" +
+                "Dependent variable: {1}\n{2}\nRows: {3}\nValues: {4}").format(
+            self.num_workers,
+            self.dependent,
+            repr(self.root),
+            self.dataset.num_rows,
+            self.values
+        )
+
+
+def serve(connection, shard_file, dependent_index=-1, columns=None,
+          missing=dataset.MISSING):
+    """
+    Load the given shard as a Worker and handle the requests of a
+    DistributedTree from the given connection until told to stop.
+
+    Args:
+        connection: a multiprocessing Connection to the coordinator.
+        shard_file, dependent_index, columns, missing: see Worker.
+
+    """
+    try:
+        worker = Worker(shard_file, dependent_index, columns, missing)
+    except Exception:
+        # Fail every request, so that the coordinator reports the error
+        worker, failure = None, WorkerError(traceback.format_exc())
+    while True:
+        request = cPickle.loads(connection.recv_bytes())
+        if request is None:
+            break
+        elif worker is None:
+            connection.send_bytes(cPickle.dumps(failure))
+            continue
+        start = time.clock()
+        try:
+            if request[0] not in worker.commands:
+                raise ValueError("unknown request {0!r}".format(request[0]))
+            reply = getattr(worker, request[0])(*request[1:])
+        except Exception:
+            reply = WorkerError(traceback.format_exc())
+        worker.cpu += time.clock() - start
+        connection.send_bytes(cPickle.dumps(reply, cPickle.HIGHEST_PROTOCOL))
+    connection.close()
+
+
+def connect(address, authkey, shard_file, dependent_index=-1, columns=None,
+            missing=dataset.MISSING):
+    """
+    Connect to a coordinator started with DistributedTree.listen() and serve
+    it the given shard.
+
+    Args:
+        address: the (host, port) tuple the coordinator listens on.
+        authkey: the key to authenticate with.
+        shard_file, dependent_index, columns, missing: see Worker.
+
+    """
+    serve(Client(address, authkey=authkey), shard_file, dependent_index,
+          columns, missing)
+
+
+def parse_address(address):
+    """
+    Parse a host:port string into a (host, port) tuple.
+
+    """
+    host, _, port = address.rpartition(':')
+    return host, int(port)
+
+
+if __name__ == '__main__':
+    import argparse
+    import pprint
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description='Train a decision tree over shards of the training data '
+        'held by worker processes. Starts a local worker per shard, or with '
+        '--listen waits for workers started elsewhere with --connect.')
+    parser.add_argument('shard_files', nargs='*',
+                        help='names of the (training) .csv shards')
+    parser.add_argument('-t', '--testing_file', type=argparse.FileType('r'),
+                        help='name of the testing .csv file')
+    parser.add_argument('-r', '--rules', action='store_true',
+                        help='print out individual paths down the tree')
+    parser.add_argument('-i', '--dependent_index', type=int, default=-1,
+                        help='column index of the dependent variable')
+    parser.add_argument('--columns', nargs='+',
+                        help='independent columns to learn from')
+    parser.add_argument('--infer_numeric', action='store_true',
+                        help='treat entirely numeric columns as numbers')
+    parser.add_argument('--missing', nargs='*', default=dataset.MISSING,
+                        help='values which mark a missing value')
+    parser.add_argument('--criterion', choices=sorted(criteria.CRITERIA),
+                        default='information_gain',
+                        help='split criterion used to create the tree')
+    parser.add_argument('--listen', metavar='HOST:PORT',
+                        help='wait for workers to connect to this address')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='number of workers to wait for with --listen')
+    parser.add_argument('--connect', metavar='HOST:PORT',
+                        help='serve the shard to the coordinator at this '
+                        'address')
+    parser.add_argument('--authkey',
+                        help='key workers authenticate with over sockets')
+    parser.add_argument('-s', '--save', type=argparse.FileType('wb'),
+                        help='write the created tree to the given model file')
+
+    args = parser.parse_args()
+    if (args.listen or args.connect) and not args.authkey:
+        sys.exit('distributed.py: error: --authkey is required with sockets')
+
+    if args.connect:
+        if len(args.shard_files) != 1:
+            sys.exit('distributed.py: error: a worker serves one shard')
+        connect(parse_address(args.connect), args.authkey,
+                args.shard_files[0], args.dependent_index, args.columns,
+                args.missing)
+        sys.exit()
+
+    if args.listen:
+        if not args.workers:
+            sys.exit('distributed.py: error: --workers is required with '
+                     '--listen')
+        tree = DistributedTree.listen(parse_address(args.listen),
+                                      args.workers, args.authkey,
+                                      args.infer_numeric, args.missing)
+    elif args.shard_files:
+        tree = DistributedTree.spawn(args.shard_files, args.dependent_index,
+                                     args.columns, args.infer_numeric,
+                                     args.missing)
+    else:
+        sys.exit('distributed.py: error: no shards or --listen given')
+
+    try:
+        tree.create_tree(criteria.CRITERIA[args.criterion]())
+    finally:
+        tree.close()
+    print repr(tree)
+
+    if args.rules:
+        pprint.pprint(tree.rules(), width=400)
+
+    if args.save:
+        tree.save(args.save)
+
+    if args.testing_file:
+        tree.test_file(args.testing_file)
@@ -4,8 +4,28 @@ construction algorithms.
 
 """
 
-import csv
+import array
 from collections import Counter
+from itertools import compress, islice, izip, repeat
+import json
+
+import criteria
+import dataset
+
+# The number of rows whose codes are fetched from the data set at a time
+# while building, which bounds the memory used per pass over a node's rows
+CHUNK_SIZE = 65536
+
+# The ways decisions handle missing or unseen values, see decide_batch()
+STRATEGIES = ('distribute', 'majority')
+
+# The types of attribute values, by their names in model files
+TYPES = dict((t.__name__, t) for t in (str, int, float))
+
+# Assignments of rows which belong to no node, or to several nodes, while
+# building level by level
+_DONE = -1
+_SHARED = -2
 
 
 class DTree(object):
@@ -15,7 +35,15 @@ class DTree(object):
 
     """
 
-    def __init__(self, training_file):
+    criterion = criteria.InformationGain()
+    # As MINOBJS in C4.5, a split is only considered if at least two of its
+    # branches get this much known training weight, so that neither small
+    # subsets nor fractional rows with missing values fragment the tree
+    min_split_weight = 2.
+
+    def __init__(self, training_file, dependent_index=-1, columns=None,
+                 infer_numeric=False, cache=False, missing=dataset.MISSING,
+                 mmap_dir=None):
         """
         Initialize the decision tree from the given filename by parsing CSV
         data and setting necessary attributes.
@@ -23,6 +51,8 @@ class DTree(object):
         Args:
             filename: relative or absolute filepath to CSV file. CSV must
             follow format specified in README.
+            dependent_index, columns, infer_numeric, cache, missing,
+                mmap_dir: passed on to parse_csv().
         Returns:
             An Decision Tree instance ready for learning with a decision tree
             creation algorithm.
@@ -30,41 +60,78 @@ class DTree(object):
         """
         self.training_file = training_file
         self.root = None
-        self.parse_csv()
+        self.criterion_name = None
+        self.parse_csv(dependent_index, columns, infer_numeric, cache,
+                       missing, mmap_dir)
         self.get_distinct_values()
 
-    def parse_csv(self, dependent_index=-1):
+    def parse_csv(self, dependent_index=-1, columns=None, infer_numeric=False,
+                  cache=False, missing=dataset.MISSING, mmap_dir=None):
         """
-        Set the object's attributes and data, where attributes is a list of
-        attributes and data is an array of row dictionaries keyed by attribute.
+        Set the object's attributes and encoded data set, where attributes is
+        a list of attributes and dataset is an EncodedDataset holding one
+        array of value codes per attribute.
 
-        Also sets the dependent variable, which defaults to the last one. An
-        option to change the position of this dependent variable has not yet
-        been implemented.
+        Also sets the dependent variable, which defaults to the last one.
 
         Args:
             dependent_index: the index to be specified as the dependent
                 variable (default -1).
-        Raises:
-            NotImplementedError: If dependent_index is specified, since I
-                haven't implemented that yet.
+            columns: the independent attributes to learn from (default None,
+                which uses every column).
+            infer_numeric: whether or not to convert entirely numeric columns
+                to ints or floats (default False).
+            cache: whether or not to cache the encoded data set next to the
+                CSV file, so that parsing is skipped on later runs (default
+                False).
+            missing: the field values which mark a missing value (default
+                dataset.MISSING).
+            mmap_dir: a directory to convert the CSV file into and train from
+                through mmap instead of memory, for data sets larger than
+                memory (default None). Replaces cache, as the converted
+                directory is reused while the CSV file is unchanged.
 
         """
-        if dependent_index != -1:
-            raise NotImplementedError
+        if mmap_dir is not None:
+            self.dataset = dataset.MappedDataset.from_csv(
+                self.training_file,
+                mmap_dir,
+                dependent_index=dependent_index,
+                columns=columns,
+                infer_numeric=infer_numeric,
+                missing=missing
+            )
+        else:
+            self.dataset = dataset.EncodedDataset.from_csv(
+                self.training_file,
+                dependent_index=dependent_index,
+                columns=columns,
+                infer_numeric=infer_numeric,
+                missing=missing,
+                cache=cache
+            )
+        self.set_dataset(self.dataset, missing)
+
+    def set_dataset(self, data_set, missing=dataset.MISSING):
+        """
+        Set the encoded data set to learn from, along with the attributes,
+        dependent variable and column types taken from it.
 
-        reader = csv.reader(self.training_file)
-        attributes = reader.next()
-        data = []
-        for row in reader:
-            row = dict(zip(attributes, row))
-            data.append(row)
-        self.training_file.close()
+        Args:
+            data_set: an EncodedDataset.
+            missing: the field values which mark a missing value (default
+                dataset.MISSING).
 
-        self.dependent = attributes[dependent_index]
-        self.attributes = [a for a in attributes if a != self.dependent]
-        self.all_attributes = attributes
-        self.data = data
+        """
+        self.dataset = data_set
+        self.dependent = data_set.dependent
+        self.attributes = [a for a in data_set.attributes
+                           if a != self.dependent]
+        self.all_attributes = data_set.attributes
+        self.header = data_set.header
+        self.types = data_set.types
+        self.missing = missing
+        self._data = None
 
     def get_distinct_values(self):
         """
@@ -77,9 +144,20 @@ class DTree(object):
         """
         values = {}
         for attr in self.all_attributes:  # Use all attributes because ugly
-            values[attr] = set(r[attr] for r in self.data)
+            values[attr] = set(self.dataset.values[attr])
         self.values = values
 
+    @property
+    def data(self):
+        """
+        Return the CSV data as an array of row dictionaries keyed by
+        attribute, decoding it from the encoded data set on first access.
+
+        """
+        if self._data is None:
+            self._data = self.dataset.rows()
+        return self._data
+
     def plot(self, x=1, y=1):
         """
         Recursively plot the given node and its children with matplotlib
@@ -93,7 +171,7 @@ class DTree(object):
         """
         self.root._plot()
 
-    def decide(self, attributes):
+    def decide(self, attributes, strategy='distribute'):
         """
         Make a decision on the dependent variable of the tree given the
         provided attributes.
@@ -101,18 +179,112 @@ class DTree(object):
         Args:
             attributes: the list of independent attributes, correctly ordered,
                 with which to make a decision on the dependent value.
+            strategy: how missing or unseen values are handled, see
+                decide_batch() (default 'distribute').
         Returns:
             A dependent variable representing the decision tree decision.
         Raises:
-            ValueError: if an invalid property is found which is not
-                represented in the decision tree.
+            ValueError: if the number of attributes does not match the data,
+                or the strategy is unknown.
+
+        """
+        return self.decide_batch([attributes], strategy)[0]
+
+    def decide_batch(self, rows, strategy='distribute', trace=False):
+        """
+        Make a decision on the dependent variable for every row of
+        attributes.
+
+        A missing or unseen value of a decision attribute never raises an
+        error. With the 'distribute' strategy the row is sent down every
+        branch of that node and the decisions reached are combined, weighted
+        by the share of training data that went down each branch (as in
+        C4.5). With the 'majority' strategy the most common dependent value of
+        the training data at that node is used instead.
+
+        Args:
+            rows: the list of attribute lists, each ordered like decide().
+            strategy: either 'distribute' or 'majority' (default
+                'distribute').
+            trace: whether or not to also return the decision path of every
+                row (default False).
+        Returns:
+            A list of dependent variables, one per row. If trace is set, a
+            tuple of that list and a list of decision paths, each the tuple
+            of the ids of the nodes visited by the row from the root down.
+        Raises:
+            ValueError: if the number of attributes in a row does not match
+                the data, or the strategy is unknown.
+
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError("unknown strategy {0!r}, expected one of "
+                             "{1}".format(strategy, ', '.join(STRATEGIES)))
+        positions, numeric = self.positions, self.numeric
+        decisions = []
+        paths = []
+        for row in rows:
+            if len(row) != len(positions):
+                raise ValueError("supplied attributes do not match data")
+            if numeric:
+                row = list(row)
+                for i, convert in numeric:
+                    row[i] = self._convert(convert, row[i])
+
+            node = self.root
+            while not node.leaf:
+                child = node.branches.get(row[positions[node.label]])
+                if child is None:
+                    break
+                node = child
+
+            below = None
+            if node.leaf:
+                decisions.append(node.label)
+            elif strategy == 'majority':
+                decisions.append(node.majority)
+            else:
+                votes = Counter()
+                below = [] if trace else None
+                node._vote(row, positions, 1., votes, below)
+                decisions.append(max(votes, key=votes.get) if votes
+                                 else node.majority)
+
+            if trace:
+                # Only nodes in shared subtrees have no path of their own
+                path = node.path
+                if path is None:
+                    path = self._trace(row, node)
+                paths.append(path + tuple(below) if below else path)
+        if trace:
+            return decisions, paths
+        return decisions
+
+    def _trace(self, row, node):
+        """
+        Return the tuple of the ids of the nodes visited by the given
+        (converted) row from the root down to the given node.
+
+        """
+        path = [self.root.id]
+        current = self.root
+        while current is not node:
+            current = current.branches[row[self.positions[current.label]]]
+            path.append(current.id)
+        return tuple(path)
+
+    def _convert(self, convert, value):
+        """
+        Convert a value of a numeric attribute, returning None for missing
+        and unparseable values.
 
         """
-        if len(attributes) != len(self.attribute_order):
-            print self.attribute_order
-            raise ValueError("supplied attributes do not match data")
-        attrs_dict = dict(zip(self.attribute_order, attributes))
-        return self.root._decide(attrs_dict)
+        if value is None or value in self.missing:
+            return None
+        try:
+            return convert(value)
+        except ValueError:
+            return None
 
     def test_file(self, testing_file, csv=None):
         """
@@ -134,23 +306,28 @@ class DTree(object):
         reader = csv.reader(testing_file)
         first_row = reader.next()
         # If first row
-        if first_row == self.all_attributes or first_row == self.attributes:
+        if first_row in (self.header, self.all_attributes, self.attributes):
             test_data = []
         else:
-            test_data = [dict(zip(self.all_attributes, first_row))]
+            test_data = [dict(zip(self.header, first_row))]
         for row in reader:
-            row = dict(zip(self.all_attributes, row))
+            row = dict(zip(self.header, row))
             test_data.append(row)
 
         testing_file.close()
 
         correct = 0.  # Keep track of statistics
-        for row in test_data:
-            formatted = [row[a] for a in self.attributes]
-            decision = self.decide(formatted)
+        # Fields missing from short rows are decided as missing values
+        formatted_rows = [[test_row.get(a) for a in self.attributes]
+                          for test_row in test_data]
+        decisions = self.decide_batch(formatted_rows)
+        for test_row, formatted, decision in zip(test_data, formatted_rows,
+                                                 decisions):
             try:
-                expected_str = "(expected {0})".format(row[self.dependent])
-                if row[self.dependent] == decision:
+                expected = self._convert(self.types[self.dependent],
+                                         test_row[self.dependent])
+                expected_str = "(expected {0})".format(expected)
+                if expected == decision:
                     correct += 1
                     expected_str += ", CORRECT"
                 else:
@@ -160,6 +337,550 @@ class DTree(object):
             print "{0} -> {1} {2}".format(formatted, decision, expected_str)
         print "% correct: {0}".format(correct/len(test_data))
 
+    def compress(self):
+        """
+        Merge identical subtrees of the decision tree so that each distinct
+        subtree is stored only once, turning the tree into a DAG. Two subtrees
+        are identical if their labels, properties, children and branch values
+        all match, wherever they hang in the tree, so decisions, rules, depth
+        and leaf counts are unchanged.
+
+        Returns:
+            A tuple of the number of stored nodes before and after
+            compression.
+
+        """
+        before = self.num_nodes
+        self.root = self.root._intern({})
+        self._number_nodes()
+        return before, self.num_nodes
+
+    def save(self, model_file):
+        """
+        Write the decision tree to the given file as a flat table of nodes,
+        so that a model can be reused without retraining. Shared subtrees of a
+        compressed tree are written once.
+
+        Models are written as plain JSON data, with value types stored by
+        name, so that loading a model never runs code from the file.
+
+        Args:
+            model_file: a binary file opened for writing. This function will
+                automatically close the file after usage.
+
+        """
+        nodes = self.root._unique_nodes()
+        index = dict((id(n), i) for i, n in enumerate(nodes))
+        model = {
+            'dependent': self.dependent,
+            'attributes': self.attributes,
+            'all_attributes': self.all_attributes,
+            'header': self.header,
+            'types': dict((a, t.__name__) for a, t in self.types.items()),
+            'attribute_order': self.attribute_order,
+            'values': dict((a, sorted(v)) for a, v in self.values.items()),
+            'missing': list(self.missing),
+            'criterion': self.criterion_name,
+            # Links are stored by the parents, as subtrees may be shared
+            'nodes': [(n.label, n.leaf, n.properties, n.majority,
+                       [index[id(c)] for c in n.children], n.weights,
+                       n.child_values) for n in nodes],
+            'root': index[id(self.root)],
+        }
+        # Any byte string round trips through latin-1
+        json.dump(model, model_file, encoding='latin-1',
+                  separators=(',', ':'))
+        model_file.close()
+
+    @classmethod
+    def load(cls, model_file):
+        """
+        Create a decision tree from a model file written by save(). The
+        returned tree can make decisions but holds no training data.
+
+        Args:
+            model_file: a binary file opened for reading. This function will
+                automatically close the file after usage.
+        Returns:
+            A Decision Tree instance with the stored tree set as its root.
+        Raises:
+            ValueError: if the file is not a model written by save().
+
+        """
+        try:
+            model = json.load(model_file)
+        finally:
+            model_file.close()
+        if not isinstance(model, dict):
+            raise ValueError("invalid model file")
+        # The node table is converted per node below, as it is the bulk of
+        # the model
+        node_table = model.pop('nodes', None)
+        model = _from_json(model)
+
+        tree = cls.__new__(cls)
+        tree.training_file = model_file
+        try:
+            tree.dependent = model['dependent']
+            tree.attributes = model['attributes']
+            tree.all_attributes = model['all_attributes']
+            tree.header = model['header']
+            tree.types = dict((a, TYPES[t])
+                              for a, t in model['types'].items())
+            tree.missing = model['missing']
+            tree.values = dict((a, set(v))
+                               for a, v in model['values'].items())
+            tree.criterion_name = model['criterion']
+            tree.dataset = None
+            tree._data = []
+            tree.set_attributes(model['attribute_order'])
+
+            # Children always precede their parents in the node table
+            nodes = []
+            for (label, leaf, properties, majority, children, weights,
+                 values) in node_table:
+                # Only labels, values and property names are strings
+                node = DTreeNode(_from_json(label), leaf=leaf,
+                                 majority=_from_json(majority),
+                                 properties=dict(
+                                     (k.encode('latin-1'), v)
+                                     for k, v in properties.items()))
+                for i, weight, value in zip(children, weights,
+                                            map(_from_json, values)):
+                    node.add_child(nodes[i], weight, value)
+                nodes.append(node)
+            tree.root = nodes[model['root']]
+        except (KeyError, IndexError, TypeError, AttributeError) as e:
+            raise ValueError("invalid model file: {0!r}".format(e))
+        tree._number_nodes()
+        return tree
+
+    def _number_nodes(self):
+        """
+        Set the id of every distinct node of the tree, numbering them from 0
+        at the root so that parents come before their children. Also sets the
+        path of ids down to every node which can only be reached one way.
+
+        """
+        for i, node in enumerate(reversed(self.root._unique_nodes())):
+            node.id = i
+        self.root._set_paths((), set())
+
+    def feature_importances(self, key=None):
+        """
+        Return the importance of each independent attribute, that is the sum
+        of the scores of the nodes splitting on it, each weighted by the
+        share of training data which reached the node. Importances are
+        normalized to sum to 1.
+
+        Shared subtrees are only visited once, so this takes a single pass
+        over the distinct nodes of the tree.
+
+        Args:
+            key: the node property holding the split score (default None,
+                which uses the name of the criterion the tree was created
+                with, e.g. 'information_gain').
+        Returns:
+            A dictionary with attribute keys and float importance values.
+        Raises:
+            ValueError: if the tree splits but no split node holds a score
+                under key.
+
+        """
+        if key is None:
+            key = self.criterion_name
+        totals = self.root._importances(key, {})
+        if not totals and not self.root.leaf:
+            raise ValueError("no split node holds a {0!r} score".format(key))
+        importances = dict.fromkeys(self.attributes, 0.)
+        total = float(sum(totals.values()))
+        for attr, importance in totals.items():
+            importances[attr] = importance / total if total else 0.
+        return importances
+
+    def create_tree(self, criterion=None, rows=None, weights=None,
+                    parent=None, parent_value=None, remaining=None,
+                    parent_counts=None, counts=None):
+        """
+        Recursively create the decision tree with the specified rows of the
+        encoded data set and node positions, splitting on the attribute which
+        scores best under the given criterion. Sets the created tree to
+        self.root and the name of the criterion to self.criterion_name.
+
+        Missing values are handled as in C4.5: they are left out when scoring
+        a split, the score is scaled down by the fraction of data that is
+        known, and rows missing the split attribute go down every branch with
+        their weight split in proportion to the known data of each branch.
+
+        Args:
+            criterion: the criteria.Criterion used to score splits (default
+                None, which uses self.criterion).
+            rows: the row indices of the data set to create decision nodes on
+                (default None, which is interpreted as using every row with a
+                known dependent value).
+            weights: the weight of each row (default None, which gives every
+                row a weight of 1).
+            parent: the parent of the node to be created (default None, which
+                sets the root of the dtree).
+            parent_value: the name of the value connecting the parent node and
+                the current node (default None).
+            remaining: the attributes still available for splitting (default
+                None, which uses every attribute).
+            parent_counts: the class counts of the parent node, used to label
+                nodes which have no rows (default None).
+            counts: the class counts of rows (default None, which counts them
+                with class_counts()). Children are given the counts from their
+                parent's contingency table, which saves a pass over the data
+                per node.
+
+        """
+        if criterion is None:
+            criterion = self.criterion
+
+        if rows is None:
+            rows = self.dataset.new_array('i')
+            weights = self.dataset.new_array('d')
+            for r, code in enumerate(self.dataset.codes[self.dependent]):
+                if code != dataset.MISSING_CODE:
+                    rows.append(r)
+                    weights.append(1.)
+
+        if remaining is None:
+            remaining = self.attributes
+
+        if counts is None:
+            counts = self.class_counts(rows, weights)
+        use_parent = not any(counts)
+        if use_parent:
+            # Nothing has been found for the given subset. We label the node
+            # based on the parent subset instead
+            counts = parent_counts
+
+        tables = None
+        if self._splittable(counts, use_parent, remaining):
+            tables = self.contingencies(rows, weights, remaining)
+        node, table = self._create_node(criterion, counts, use_parent,
+                                        remaining, tables, parent_value)
+
+        if parent is None:
+            # Set known order of attributes for dtree decisions
+            self.set_attributes(self.attributes)
+            self.root = node
+            self.criterion_name = criterion.name
+
+        if not node.leaf:  # Continue recursing
+            # Remove the just used attribute from the remaining list
+            new_remaining = remaining[:]
+            new_remaining.remove(node.label)
+            fractions = self._known_fractions(table)
+            parts = self.split_rows(rows, weights, node.label, fractions)
+            for value, (child_rows, child_weights), child_counts in zip(
+                    self.dataset.values[node.label], parts,
+                    self._child_counts(table, fractions)):
+                self.create_tree(
+                    criterion=criterion,
+                    rows=child_rows,
+                    weights=child_weights,
+                    parent=node,
+                    parent_value=value,
+                    remaining=new_remaining,
+                    parent_counts=counts,
+                    counts=child_counts
+                )
+
+        if parent is not None:
+            parent.add_child(node, 0. if use_parent else sum(counts))
+        else:
+            self._number_nodes()
+
+    def create_tree_levelwise(self, criterion=None):
+        """
+        Create the same decision tree as create_tree(), but breadth first:
+        every node of a depth is scored from a single sequential pass over
+        the encoded data set, so the data is scanned once per level of the
+        tree rather than once per node. Sets the created tree to self.root.
+
+        The node of each row is tracked in an assignment array, which the
+        pass over a level first advances by the splits of the level above.
+        Rows missing a split attribute belong to several nodes at once (see
+        create_tree()) and are tracked apart with their weights, in
+        SharedRows.
+
+        Args:
+            criterion: the criteria.Criterion used to score splits (default
+                None, which uses self.criterion).
+        Returns:
+            The number of passes made over the data set.
+
+        """
+        if criterion is None:
+            criterion = self.criterion
+
+        self.set_attributes(self.attributes)
+        frontier = [PendingNode(None, None, self.attributes)]
+        previous = None
+        assignment = array.array('i')
+        shared = SharedRows(self.dataset)
+        passes = 0
+        while frontier:
+            for pending in frontier:
+                # The class counts of the root are only known after a pass
+                pending.scored = (pending.counts is None or self._splittable(
+                    pending.counts, pending.use_parent, pending.remaining))
+            if any(p.scored for p in frontier):
+                self.level_pass(frontier, previous, assignment, shared)
+                passes += 1
+            root = frontier[0]
+            if root.counts is None:
+                root.counts = root.totals
+                root.use_parent = not any(root.totals)
+                if not self._splittable(root.counts, root.use_parent,
+                                        root.remaining):
+                    root.tables = None
+
+            children = []
+            for pending in frontier:
+                node, table = self._create_node(
+                    criterion, pending.counts, pending.use_parent,
+                    pending.remaining, pending.tables, pending.parent_value)
+                pending.tables = None
+                if pending.parent is None:
+                    self.root = node
+                    self.criterion_name = criterion.name
+                else:
+                    pending.parent.add_child(
+                        node, 0. if pending.use_parent else
+                        sum(pending.counts))
+                if node.leaf:
+                    continue
+
+                new_remaining = pending.remaining[:]
+                new_remaining.remove(node.label)
+                pending.split = node.label
+                pending.fractions = self._known_fractions(table)
+                pending.children = range(len(children), len(children) +
+                                         len(pending.fractions))
+                for value, child_counts in zip(
+                        self.dataset.values[node.label],
+                        self._child_counts(table, pending.fractions)):
+                    children.append(PendingNode(
+                        node, value, new_remaining, child_counts,
+                        pending.counts))
+            previous, frontier = frontier, children
+
+        self._number_nodes()
+        return passes
+
+    def level_pass(self, frontier, previous, assignment, shared):
+        """
+        Make one sequential pass over the encoded data set, moving each row
+        from its node in the previous level to its child in the frontier,
+        and adding it to the contingency tables of the frontier node. Sets
+        the tables of every scored frontier node, and the class totals of
+        those whose counts are unknown (the root).
+
+        Args:
+            frontier: the list of PendingNodes of the current level.
+            previous: the list of PendingNodes of the previous level (None
+                for the root level, in which case assignment is filled in).
+            assignment: an array of the index in frontier of each row's node,
+                or one of _DONE and _SHARED.
+            shared: the SharedRows of the rows assigned to _SHARED, which is
+                advanced to the frontier along with assignment.
+
+        """
+        num_classes = len(self.dataset.values[self.dependent])
+        for pending in frontier:
+            if pending.scored:
+                pending.tables = self.empty_tables(pending.remaining)
+                if pending.counts is None:
+                    pending.totals = [0.] * num_classes
+
+        # Only read the columns which are split on or counted
+        needed = set([self.dependent])
+        needed.update(p.split for p in previous or () if p.split)
+        for pending in frontier:
+            if pending.scored:
+                needed.update(pending.remaining)
+
+        missing = dataset.MISSING_CODE
+        shared_owners = iter(shared)
+        routed_shared = SharedRows(self.dataset)
+        for start in xrange(0, self.dataset.num_rows, CHUNK_SIZE):
+            stop = min(start + CHUNK_SIZE, self.dataset.num_rows)
+            columns = dict((a, self.dataset.read(a, start, stop))
+                           for a in needed)
+            dependent = columns[self.dependent]
+
+            # Offsets into the chunk of the rows of each node, and their
+            # weights once a node has rows of weight other than 1
+            offsets = [[] for _ in frontier]
+            weights = [None] * len(frontier)
+            if previous is None:
+                known = [d != missing for d in dependent]
+                assignment.extend(0 if k else _DONE for k in known)
+                offsets[0] = list(compress(xrange(stop - start), known))
+            else:
+                splits = [p.split and columns[p.split] for p in previous]
+                for i, p in enumerate(assignment[start:stop]):
+                    if p >= 0:
+                        parent = previous[p]
+                        if parent.split is None:
+                            assignment[start + i] = _DONE
+                            continue
+                        code = splits[p][i]
+                        if code != missing:
+                            child = parent.children[code]
+                            assignment[start + i] = child
+                            offsets[child].append(i)
+                            if weights[child] is not None:
+                                weights[child].append(1.)
+                            continue
+                        owners = ((p, 1.),)
+                    elif p == _DONE:
+                        continue
+                    else:
+                        owners = next(shared_owners)
+
+                    routed = []
+                    for p, w in owners:
+                        parent = previous[p]
+                        if parent.split is None:
+                            continue
+                        code = splits[p][i]
+                        if code != missing:
+                            routed.append((parent.children[code], w))
+                        else:
+                            routed.extend(
+                                (c, w * f) for c, f in
+                                zip(parent.children, parent.fractions) if f)
+                    for child, w in routed:
+                        if weights[child] is None:
+                            weights[child] = [1.] * len(offsets[child])
+                        offsets[child].append(i)
+                        weights[child].append(w)
+                    if routed:
+                        assignment[start + i] = _SHARED
+                        routed_shared.append(routed)
+                    else:
+                        assignment[start + i] = _DONE
+
+            for pending, rows, row_weights in zip(frontier, offsets, weights):
+                if not pending.scored or not rows:
+                    continue
+                classes = map(dependent.__getitem__, rows)
+                if row_weights is None:
+                    row_weights = repeat(1.)
+                if pending.counts is None:
+                    for d, w in izip(classes, row_weights):
+                        pending.totals[d] += w
+                for attr, table in zip(pending.remaining, pending.tables):
+                    codes = map(columns[attr].__getitem__, rows)
+                    for c, d, w in izip(codes, classes, row_weights):
+                        # MISSING_CODE indexes the trailing missing value
+                        # counts
+                        table[c][d] += w
+        shared.replace(routed_shared)
+
+    def _splittable(self, counts, use_parent, remaining):
+        """
+        Return whether or not a node with the given class counts may be
+        split, which is when it holds enough training weight for two branches
+        (see min_split_weight) of more than one dependent value and
+        attributes remain to split on.
+
+        """
+        return bool(remaining and not use_parent and
+                    sum(1 for c in counts if c) > 1 and
+                    sum(counts) >= 2 * self.min_split_weight)
+
+    def _create_node(self, criterion, counts, use_parent, remaining, tables,
+                     parent_value):
+        """
+        Create the decision tree node for the given class counts, splitting
+        on the attribute which scores best under the given criterion.
+
+        Args:
+            criterion: the criteria.Criterion used to score splits.
+            counts: the class counts of the node.
+            use_parent: whether or not counts are those of the parent node,
+                as the node has no rows.
+            remaining: the attributes still available for splitting.
+            tables: the contingency tables of the remaining attributes, or
+                None if the node is not splittable.
+            parent_value: the name of the value connecting the parent node and
+                the node.
+        Returns:
+            A tuple of the created DTreeNode and the contingency table of its
+            split attribute (None for leaves).
+
+        """
+        classes = self.dataset.values[self.dependent]
+        majority = classes[max(xrange(len(counts)), key=counts.__getitem__)]
+
+        # If every element in the subset belongs to one dependent group, label
+        # with that group.
+        pure = not use_parent and sum(1 for c in counts if c) == 1
+
+        scores = []
+        if tables is not None:
+            # Score every attribute splitting off at least two branches with
+            # enough known weight
+            for attr, table in zip(remaining, tables):
+                if sum(1 for c in table[:-1]
+                       if sum(c) >= self.min_split_weight) > 1:
+                    scores.append((attr, criterion.score(table), table))
+
+        if pure:  # Only one value of self.dependent detected
+            return DTreeNode(
+                label=majority,
+                leaf=True,
+                parent_value=parent_value
+            ), None
+        elif not scores:
+            # If there are no remaining attributes (or too little data to
+            # split), label with the most common attribute in the subset.
+            return DTreeNode(
+                label=majority,
+                leaf=True,
+                parent_value=parent_value,
+                properties={'estimated': True}
+            ), None
+
+        best = max(scores, key=lambda a: a[1])
+
+        # Create the decision tree node
+        return DTreeNode(
+            best[0],
+            properties={criterion.name: best[1]},
+            parent_value=parent_value,
+            majority=majority
+        ), best[2]
+
+    def _known_fractions(self, table):
+        """
+        Return the fraction of known data per value code of the given
+        contingency table, by which rows missing its attribute are split.
+
+        """
+        known = [sum(c) for c in table[:-1]]
+        total = sum(known)
+        return [k / total for k in known]
+
+    def _child_counts(self, table, fractions):
+        """
+        Return the class counts of the children of a node split by the given
+        contingency table, including their share of the rows missing the
+        split attribute.
+
+        """
+        counts = []
+        for known, fraction in zip(table, fractions):
+            if fraction:
+                known = [k + m * fraction for k, m in zip(known, table[-1])]
+            counts.append(known)
+        return counts
+
     def filter_subset(self, subset, attr, value):
         """
         Filter a subset of CSV data further by selecting only the rows of
@@ -224,6 +945,11 @@ class DTree(object):
 
         """
         self.attribute_order = attributes
+        self.positions = dict((a, i) for i, a in enumerate(attributes))
+        # Categorical values need no conversion: missing markers are never
+        # branch values, so they are already handled like unseen values
+        self.numeric = [(i, self.types[a]) for i, a in enumerate(attributes)
+                        if self.types[a] is not str]
 
     def attr_counts(self, subset, attr):
         """
@@ -242,6 +968,120 @@ class DTree(object):
             counts[row[attr]] += 1
         return counts
 
+    def class_counts(self, rows, weights):
+        """
+        Get the weighted number of occurrences per dependent value code over
+        the given rows of the encoded data set.
+
+        Args:
+            rows: the row indices with which to act upon.
+            weights: the weight of each row.
+        Returns:
+            A list of weighted counts indexed by dependent value code.
+
+        """
+        counts = [0.] * len(self.dataset.values[self.dependent])
+        for chunk_rows, chunk_weights in self._chunks(rows, weights):
+            dependent = self.dataset.take(self.dependent, chunk_rows)
+            for d, w in izip(dependent, chunk_weights):
+                counts[d] += w
+        return counts
+
+    def contingency(self, rows, weights, attr):
+        """
+        Get the weighted number of occurrences per dependent value code for
+        each value code of the given attribute over the given rows of the
+        encoded data set.
+
+        Args:
+            rows: the row indices with which to act upon.
+            weights: the weight of each row.
+            attr: the selected attribute.
+        Returns:
+            A list of weighted class counts (see class_counts()) per value
+            code of attr, followed by the class counts of the rows where attr
+            is missing.
+
+        """
+        return self.contingencies(rows, weights, [attr])[0]
+
+    def contingencies(self, rows, weights, attrs):
+        """
+        Get the contingency table (see contingency()) of each of the given
+        attributes in a single pass over the given rows.
+
+        Args:
+            rows: the row indices with which to act upon.
+            weights: the weight of each row.
+            attrs: the selected attributes.
+        Returns:
+            A list of contingency tables, one per attribute in attrs.
+
+        """
+        tables = self.empty_tables(attrs)
+        for chunk_rows, chunk_weights in self._chunks(rows, weights):
+            dependent = self.dataset.take(self.dependent, chunk_rows)
+            for attr, table in zip(attrs, tables):
+                column = self.dataset.take(attr, chunk_rows)
+                for c, d, w in izip(column, dependent, chunk_weights):
+                    # MISSING_CODE indexes the trailing missing value counts
+                    table[c][d] += w
+        return tables
+
+    def empty_tables(self, attrs):
+        """
+        Return a contingency table (see contingency()) of zero counts for
+        each of the given attributes.
+
+        """
+        num_classes = len(self.dataset.values[self.dependent])
+        return [[[0.] * num_classes
+                 for _ in xrange(len(self.dataset.values[attr]) + 1)]
+                for attr in attrs]
+
+    def split_rows(self, rows, weights, attr, fractions):
+        """
+        Partition the given rows of the encoded data set by the value code of
+        the given attribute, keeping them in order. As in C4.5, rows where
+        attr is missing are added to every partition with their weight
+        multiplied by the fraction of known data in that partition.
+
+        Args:
+            rows: the ascending row indices to partition.
+            weights: the weight of each row.
+            attr: the attribute to partition upon.
+            fractions: the fraction of known data per value code of attr.
+        Returns:
+            A list of (rows, weights) array pairs per value code of attr.
+
+        """
+        spill = self.dataset.new_spill()
+        parts = [(self.dataset.new_array('i', spill),
+                  self.dataset.new_array('d', spill)) for _ in fractions]
+        shares = [(part, fraction) for part, fraction in zip(parts, fractions)
+                  if fraction]
+        for chunk_rows, chunk_weights in self._chunks(rows, weights):
+            column = self.dataset.take(attr, chunk_rows)
+            for r, w, code in izip(chunk_rows, chunk_weights, column):
+                if code == dataset.MISSING_CODE:
+                    for (part_rows, part_weights), fraction in shares:
+                        part_rows.append(r)
+                        part_weights.append(w * fraction)
+                else:
+                    parts[code][0].append(r)
+                    parts[code][1].append(w)
+        return parts
+
+    def _chunks(self, rows, weights):
+        """
+        Yield the given rows and their weights in slices of at most CHUNK_SIZE
+        rows, so that rows spilled to disk are only read a slice at a time.
+
+        """
+        for start in xrange(0, len(rows), CHUNK_SIZE):
+            yield (rows[start:start + CHUNK_SIZE],
+                   weights[start:start + CHUNK_SIZE])
+
     @property
     def depth(self):
         """
@@ -269,6 +1109,18 @@ class DTree(object):
         else:
             return sum(c._num_leaves for c in self.root.children)
 
+    @property
+    def num_nodes(self):
+        """
+        Return the number of distinct node objects in the tree. Subtrees
+        shared after compress() are only counted once.
+
+        Returns:
+            An integer of the number of stored nodes.
+
+        """
+        return len(self.root._unique_nodes())
+
     @property
     def distinct_values(self):
         """
@@ -301,14 +1153,21 @@ class DTree(object):
         Return the filename of the decision tree and other useful diagnostics.
 
         """
-        return ("decision tree for {0}:\nDependent variable: {1}\n{2}\n" +
-                "Rows: {3}\nValues: {4}\nBase Data Entropy: {5}").format(
+        text = "decision tree for {0}:\nDependent variable: {1}\n{2}".format(
             self.training_file.name,
             self.dependent,
-            repr(self.root),
-            len(self.data),
+            repr(self.root)
+        )
+        if self.dataset is None:  # Loaded from a model file
+            return text + "\nValues: {0}".format(self.values)
+        return text + ("\nRows: {0}\nValues: {1}\n" +
+                       "Base Data Entropy: {2}").format(
+            self.dataset.num_rows,
             self.values,
-            self.get_base_entropy(self.data)
+            criteria.entropy(
+                [c for code, c in
+                 Counter(self.dataset.codes[self.dependent]).items()
+                 if code != dataset.MISSING_CODE])
         )
 
     def decision_repl(self):
@@ -336,7 +1195,8 @@ class DTreeNode(object):
 
     """
 
-    def __init__(self, label, parent_value=None, properties={}, leaf=False):
+    def __init__(self, label, parent_value=None, properties={}, leaf=False,
+                 majority=None):
         """
         Initialize a decision tree node.
 
@@ -344,18 +1204,29 @@ class DTreeNode(object):
             label: the label of the node, which can either be a decision
                 attribute or a leaf result.
             parent_value: the name of the link from the current node to its
-                parent (default None, used in cases of root nodes).
+                parent when it is created (default None, used in cases of root
+                nodes). A subtree shared by compress() is linked under several
+                values, which are held by the parents (see child_values).
             properties: a JSON-like dictionary containing various diagnostic
                 properties of the given node (e.g. information gain or entropy)
                 (default empty dictionary).
             leaf: a boolean indicating whether or not this node is a leaf node
                 (default False).
+            majority: the most common dependent value of the training data
+                at this node, used for decisions on missing values (default
+                None).
         """
         self.label = label
         self.children = []
+        self.weights = []
+        self.child_values = []
+        self.branches = {}
         self.parent_value = parent_value
         self.properties = properties
         self.leaf = leaf
+        self.majority = majority
+        self.id = None
+        self.path = None
 
     def _plot(self, xoffset, yoffset):
         """
@@ -370,30 +1241,54 @@ class DTreeNode(object):
         """
         raise NotImplementedError
 
-    def _decide(self, attrs_dict):
+    def _vote(self, row, positions, weight, votes, path=None):
         """
-        Recursively decide using the given attribute/value dictionary.
+        Recursively add the given weight to the votes of the decisions reached
+        from the current node, splitting it between all branches by their
+        training weights wherever the row's value has no branch. The ids of
+        the nodes visited below the current node are added to path if given.
 
-        Internal function is separated from the more friendly decide() method.
+        Internal function is separated from the more friendly decide_batch()
+        method.
 
         """
         if self.leaf:
-            return self.label
-        val = attrs_dict[self.label]
-        for node in self.children:
-            if val == node.parent_value:
-                return node._decide(attrs_dict)
-        raise ValueError("Invalid property found: {0}".format(val))
-
-    def add_child(self, node):
+            votes[self.label] += weight
+            return
+        child = self.branches.get(row[positions[self.label]])
+        if child is not None:
+            branches = [(child, weight)]
+        else:
+            total = sum(self.weights)
+            if not total:
+                votes[self.majority] += weight
+                return
+            branches = [(node, weight * node_weight / total) for node,
+                        node_weight in zip(self.children, self.weights)
+                        if node_weight]
+        for node, node_weight in branches:
+            if path is not None:
+                path.append(node.id)
+            node._vote(row, positions, node_weight, votes, path)
+
+    def add_child(self, node, weight=0., value=None):
         """
         Add the given child node to the list of children of the current node.
 
         Args:
             node: the DTree node to be appended as a child.
+            weight: the weight of the training data which went down to the
+                child (default 0.).
+            value: the value of the link to the child (default None, which
+                uses node.parent_value).
 
         """
+        if value is None:
+            value = node.parent_value
         self.children.append(node)
+        self.weights.append(weight)
+        self.child_values.append(value)
+        self.branches[value] = node
 
     @property
     def num_children(self):
@@ -416,7 +1311,7 @@ class DTreeNode(object):
         if self.leaf:
             return 1
         else:
-            return sum(c.num_leaves for c in self.children)
+            return sum(c._num_leaves for c in self.children)
 
     def _depth(self, init):
         """
@@ -432,35 +1327,102 @@ class DTreeNode(object):
         else:
             return max(c._depth(init+1) for c in self.children)
 
-    def _rules(self, parent=None, previous=()):
+    def _rules(self, previous=()):
         """
-        Return a 2d list of decision rules with the given parent node and
-        the tuple of previous nodes.
+        Return a 2d list of decision rules with the given tuple of previous
+        (attribute, value) pairs leading to the current node.
 
         """
-        # import pdb; pdb.set_trace()
         rows = []
-        if parent is not None:
-            previous += ((parent.label, self.parent_value), )
         if self.leaf:
             previous += ((self.label), )
             rows.append(previous)
         else:
-            for node in self.children:
-                rows.extend(node._rules(self, previous))
+            for value, node in zip(self.child_values, self.children):
+                rows.extend(node._rules(previous + ((self.label, value), )))
         return rows
 
+    def _set_paths(self, previous, seen):
+        """
+        Set the path of node ids from the root down to each node under the
+        current node, or None for nodes reachable along several paths.
+
+        previous is the path down to the parent node, and seen holds the ids
+        of the nodes already reached.
+
+        """
+        path = previous + (self.id, )
+        if id(self) in seen:
+            self.path = None
+        else:
+            seen.add(id(self))
+            self.path = path
+        for node in self.children:
+            node._set_paths(path, seen)
+
+    def _importances(self, key, memo):
+        """
+        Return a Counter of the split scores stored under key in the
+        properties of the nodes under the current node, weighted by training
+        data and summed per attribute.
+
+        memo maps the ids of the nodes already visited to their totals.
+
+        """
+        if id(self) not in memo:
+            totals = Counter()
+            if not self.leaf:
+                if key in self.properties:
+                    totals[self.label] += (self.properties[key] *
+                                           sum(self.weights))
+                for node in self.children:
+                    totals.update(node._importances(key, memo))
+            memo[id(self)] = totals
+        return memo[id(self)]
+
+    def _intern(self, table):
+        """
+        Return the canonical node for the subtree at the current node,
+        replacing children with their canonical nodes along the way.
+
+        table maps subtree keys to the canonical node already seen for them.
+
+        """
+        children = [c._intern(table) for c in self.children]
+        # Branch values are kept by the parent, so subtrees are shared
+        # across them
+        key = (self.leaf, self.label, self.majority,
+               _freeze(self.properties), tuple(self.weights),
+               tuple(self.child_values), tuple(id(c) for c in children))
+        if key not in table:
+            self.children = children
+            self.branches = dict(zip(self.child_values, children))
+            table[key] = self
+        return table[key]
+
+    def _unique_nodes(self, seen=None, nodes=None):
+        """
+        Return the distinct nodes under the current node in postorder, so
+        that children always come before their parents. Shared subtrees are
+        only visited once.
+
+        """
+        if seen is None:
+            seen, nodes = set(), []
+        seen.add(id(self))
+        for node in self.children:
+            if id(node) not in seen:
+                node._unique_nodes(seen, nodes)
+        nodes.append(self)
+        return nodes
+
     def __str__(self):
         """
         Recursively build a string representation of the tree starting at the
         current node.
 
         """
-        return "--{0}--({1}, {2})".format(
-            self.parent_value,
-            self.label,
-            ', '.join(str(c) for c in self.children)
-        )
+        return self._format(self.parent_value, str)
 
     def __repr__(self):
         """
@@ -469,9 +1431,128 @@ class DTreeNode(object):
         information.
 
         """
-        return "--{0}--({1} {2}, {3})".format(
-            self.parent_value,
-            self.label,
-            self.properties,
-            ', '.join(repr(c) for c in self.children)
+        return self._format(self.parent_value, repr)
+
+    def _format(self, value, convert):
+        """
+        Recursively build the string representation of the tree starting at
+        the current node, reached through the link with the given value.
+        convert is str, or repr to include the properties of each node.
+
+        """
+        label = self.label
+        if convert is repr:
+            label = "{0} {1}".format(label, self.properties)
+        return "--{0}--({1}, {2})".format(
+            value,
+            label,
+            ', '.join(c._format(v, convert) for v, c in
+                      zip(self.child_values, self.children))
         )
+
+
+class PendingNode(object):
+    """
+    A node of the frontier of create_tree_levelwise(), which is created once
+    the pass over its level has filled in its contingency tables.
+
+    """
+
+    def __init__(self, parent, parent_value, remaining, counts=None,
+                 parent_counts=None):
+        self.parent = parent
+        self.parent_value = parent_value
+        self.remaining = remaining
+        self.use_parent = counts is not None and not any(counts)
+        # Nodes without rows are labeled from the counts of their parent
+        self.counts = parent_counts if self.use_parent else counts
+        self.scored = False
+        self.tables = None
+        self.totals = None
+        # Set once the node is created and split
+        self.split = None
+        self.fractions = None
+        self.children = None
+
+
+class SharedRows(object):
+    """
+    The rows of create_tree_levelwise() which belong to several nodes at
+    once, in row order, as flat arrays of the data set (see
+    EncodedDataset.new_array()), so that they spill to disk along with row
+    subsets when training from mmap-ed data: the number of owners of each
+    row, and the index in the frontier and weight of each owner.
+
+    """
+
+    def __init__(self, data_set):
+        """
+        Args:
+            data_set: the data set creating the arrays.
+
+        """
+        spill = data_set.new_spill()
+        self.counts = data_set.new_array('i', spill)
+        self.owners = data_set.new_array('i', spill)
+        self.weights = data_set.new_array('d', spill)
+
+    def append(self, owners):
+        """
+        Add the next shared row with the given list of (index in frontier,
+        weight) pairs.
+
+        """
+        self.counts.append(len(owners))
+        owners, weights = zip(*owners)
+        self.owners.extend(owners)
+        self.weights.extend(weights)
+
+    def replace(self, other):
+        """
+        Hold the rows of the given SharedRows instead.
+
+        """
+        self.counts, self.owners, self.weights = (other.counts, other.owners,
+                                                  other.weights)
+
+    def __iter__(self):
+        """
+        Yield the list of (index in frontier, weight) pairs of each shared
+        row in row order. Rows appended later are not yielded.
+
+        """
+        return _owner_lists(self.counts, self.owners, self.weights)
+
+
+def _owner_lists(counts, owners, weights):
+    owners, weights = iter(owners), iter(weights)
+    for count in counts:
+        yield zip(islice(owners, count), islice(weights, count))
+
+
+def _from_json(value):
+    """
+    Convert the unicode strings of a JSON value read from a model file back
+    to the byte strings written by DTree.save().
+
+    """
+    if isinstance(value, unicode):
+        return value.encode('latin-1')
+    if isinstance(value, list):
+        return [_from_json(v) for v in value]
+    if isinstance(value, dict):
+        return dict((_from_json(k), _from_json(v)) for k, v in value.items())
+    return value
+
+
+def _freeze(value):
+    """
+    Convert a JSON-like value (such as node properties) into a hashable
+    equivalent for comparing subtrees.
+
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
@@ -0,0 +1,330 @@
+"""
+Implements a versioned registry of saved decision tree models for
+long-running predictors, which picks up new models written to a directory
+and swaps them in without interrupting decisions.
+
+Decisions are made through the current ModelVersion, which is replaced by a
+single reference assignment once a new model has been completely loaded, so
+a decision never sees a partially loaded tree and decisions already under
+way finish on the version they started with.
+
+"""
+
+import collections
+import os
+import threading
+import time
+
+import dtree
+
+MODEL_EXTENSION = '.model'
+
+
+class ModelVersion(object):
+    """
+    A loaded model, which is never modified once published.
+
+    """
+
+    def __init__(self, name, tree, modified, load_seconds, swapped):
+        """
+        Args:
+            name: the filename of the model in the registry directory.
+            tree: the loaded DTree.
+            modified: the modification time of the model file.
+            load_seconds: the time taken to load the model file.
+            swapped: the time the version was made current.
+
+        """
+        self.name = name
+        self.tree = tree
+        self.modified = modified
+        self.load_seconds = load_seconds
+        self.swapped = swapped
+
+    @property
+    def latency(self):
+        """
+        Return the seconds from the model file being written to the version
+        being made current.
+
+        """
+        return self.swapped - self.modified
+
+    def __repr__(self):
+        return "ModelVersion({0!r})".format(self.name)
+
+
+class ModelRegistry(object):
+    """
+    Watches a directory of model files written by DTree.save() (see
+    publish()), loading the newest one in a background thread and making it
+    the current version. The last loaded versions are kept for rollback.
+
+    Models should be written to the directory with publish(), which renames
+    complete files into place. Files which fail to load are skipped until
+    they are modified again. Errors are kept in errors by filename, or by
+    directory for failures to list the directory in the background thread.
+
+    Model files are plain data (see DTree.save()), so loading them never
+    runs code. Still, anyone who can write to the directory controls the
+    decisions made.
+
+    """
+
+    def __init__(self, directory, keep=5, interval=1.,
+                 tree_class=dtree.DTree):
+        """
+        Initialize the registry. No model is loaded until poll() or start()
+        is called.
+
+        Args:
+            directory: the directory of model files to watch.
+            keep: the number of loaded versions kept for rollback, including
+                the current one (default 5).
+            interval: the seconds between polls of the directory by the
+                background thread (default 1).
+            tree_class: the DTree subclass whose load() reads the model files
+                (default DTree).
+
+        """
+        self.directory = directory
+        self.interval = interval
+        self.tree_class = tree_class
+        self.current = None
+        self.history = collections.deque(maxlen=keep)
+        self.errors = {}
+        self._seen = {}
+        # Serializes swaps and rollbacks; decisions never take it
+        self._lock = threading.Lock()
+        self._polling = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Load the newest model, then keep polling for new ones in a background
+        thread.
+
+        """
+        self.poll()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread, waiting for a load in progress to finish.
+
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def poll(self):
+        """
+        Load the newest model file of the directory if it has not been seen
+        yet, and make it the current version. Older unseen files are skipped,
+        unless the newer ones fail to load.
+
+        Returns:
+            The new current ModelVersion, or None if there was no new model
+            or it failed to load (see errors).
+
+        """
+        with self._polling:
+            return self._poll()
+
+    def _poll(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.') or not name.endswith(MODEL_EXTENSION):
+                continue
+            try:
+                modified = os.path.getmtime(os.path.join(self.directory, name))
+            except OSError:  # Removed since listing
+                continue
+            if self._seen.get(name) != modified:
+                files.append((modified, name))
+        for modified, name in files:
+            self._seen[name] = modified
+
+        current = self.current
+        for modified, name in sorted(files, reverse=True):
+            if current is not None and modified < current.modified:
+                break
+            start = time.time()
+            try:
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    tree = self.tree_class.load(f)
+            except Exception as e:
+                # Keep serving the current version
+                self.errors[name] = e
+                continue
+            load_seconds = time.time() - start
+
+            with self._lock:
+                version = ModelVersion(name, tree, modified, load_seconds,
+                                       time.time())
+                self.history.append(version)
+                self.current = version
+            self.errors.pop(name, None)
+            return version
+        return None
+
+    def rollback(self, name=None):
+        """
+        Make a kept version current again.
+
+        Args:
+            name: the name of the version to roll back to (default None,
+                which rolls back to the version loaded before the current
+                one).
+        Returns:
+            The new current ModelVersion.
+        Raises:
+            ValueError: if there is no such version.
+
+        """
+        with self._lock:
+            versions = list(self.history)
+            if name is None:
+                if self.current not in versions[1:]:
+                    raise ValueError("no version to roll back to")
+                version = versions[versions.index(self.current) - 1]
+            else:
+                matches = [v for v in versions if v.name == name]
+                if not matches:
+                    raise ValueError("no kept version named {0!r}".format(
+                        name))
+                version = matches[-1]
+            self.current = version
+        return version
+
+    def decide(self, attributes, strategy='distribute'):
+        """
+        Make a decision with the current version (see DTree.decide()).
+
+        """
+        return self._current().tree.decide(attributes, strategy)
+
+    def decide_batch(self, rows, strategy='distribute', trace=False):
+        """
+        Make decisions with the current version (see DTree.decide_batch()).
+        Every row of the batch is decided by the same version.
+
+        """
+        return self._current().tree.decide_batch(rows, strategy, trace)
+
+    def decision_repl(self):
+        """
+        An interactive REPL for making decisions with the current version,
+        like DTree.decision_repl(). Lines starting with '!' are commands:
+        '!versions' lists the kept versions and '!rollback [name]' rolls
+        back. The REPL can be started before any model is published, and
+        shows the attributes again whenever a new version changes them.
+
+        """
+        print
+        print "Decision tree REPL. Enter the attributes shown separated by"
+        print "commas, no spaces between commas or brackets, or !versions or"
+        print "!rollback [name]."
+        shown = None
+        if self.current is None:
+            print "No model in {0} yet.".format(self.directory)
+        while True:
+            version = self.current
+            if version is not None and version.tree.attributes != shown:
+                shown = version.tree.attributes
+                print ','.join("{{{0}}}".format(a) for a in shown)
+            line = raw_input('> ')
+            try:
+                if line.startswith('!versions'):
+                    for version in self.history:
+                        print "{0}{1} loaded in {2:.3f} s".format(
+                            '*' if version is self.current else ' ',
+                            version.name, version.load_seconds)
+                elif line.startswith('!rollback'):
+                    print "Rolled back to {0}".format(
+                        self.rollback(*line.split()[1:]).name)
+                elif self.current is None:
+                    print "No model in {0} yet.".format(self.directory)
+                else:
+                    x = line.split(',')
+                    version = self._current()
+                    print "{0} ->".format(x)
+                    print "{0} ({1})".format(version.tree.decide(x),
+                                             version.name)
+            except Exception as e:
+                print "Error with decision: {0}".format(e)
+
+    def _current(self):
+        # Read the reference once, so a call finishes on one version
+        version = self.current
+        if version is None:
+            raise RuntimeError("no model loaded from {0}".format(
+                self.directory))
+        return version
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                # e.g. the directory is briefly missing; keep watching
+                self.errors[self.directory] = e
+            else:
+                self.errors.pop(self.directory, None)
+
+
+def publish(tree, directory, name=None):
+    """
+    Save the given tree into a registry directory as a new version. The model
+    is written to a hidden file first and renamed into place, so that
+    registries never read an incomplete model.
+
+    Args:
+        tree: the DTree to save.
+        directory: the registry directory.
+        name: the filename of the model (default None, which names it after
+            the current time).
+    Returns:
+        The path of the written model file.
+
+    """
+    if name is None:
+        now = time.time()
+        name = '{0}.{1:06d}{2}'.format(
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(now)),
+            int(now % 1 * 1e6), MODEL_EXTENSION)
+    path = os.path.join(directory, name)
+    temporary = os.path.join(directory, '.' + name + '.tmp')
+    tree.save(open(temporary, 'wb'))
+    os.rename(temporary, path)
+    return path
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Make decisions with the newest model of a directory, '
+        'swapping in new models as they are published to it.')
+    parser.add_argument('directory',
+                        help='directory of .model files to watch')
+    parser.add_argument('-k', '--keep', type=int, default=5,
+                        help='number of versions kept for rollback')
+    parser.add_argument('--interval', type=float, default=1.,
+                        help='seconds between polls of the directory')
+
+    args = parser.parse_args()
+    registry = ModelRegistry(args.directory, args.keep, args.interval)
+    registry.start()
+    try:
+        registry.decision_repl()
+    except (EOFError, KeyboardInterrupt):
+        print
+    finally:
+        registry.stop()